@@ -0,0 +1,164 @@
+import time
+import logging
+from collections import deque
+import cv2
+from tracking import VideoProcessingError, VideoTrackState, create_tracker, empty_detections, iter_frames
+from cameraConfig import camera_for_video
+from motionGate import MotionGate, motion_gate_enabled, motion_stats
+from profiling import profiler
+
+_LOGGER = logging.getLogger('video_processor')
+
+
+class _VideoStream:
+    """A video being read by the engine, with its own tracker and track state."""
+
+    def __init__(self, video_path, video_id, hz, tracker_cfg, fps=None):
+        self.video_path = video_path
+        self.video_id = video_id
+        self.cap = cv2.VideoCapture(video_path)
+        if not self.cap.isOpened():
+            raise VideoProcessingError(f"Could not open video: {video_path}")
+        self.fps = int(fps or self.cap.get(cv2.CAP_PROP_FPS))
+        if self.fps <= 0:
+            self.cap.release()
+            raise VideoProcessingError(f"Invalid FPS ({self.fps}) for video: {video_path}")
+        self.frames = iter_frames(self.cap, max(1, int(self.fps // hz)))
+        self.tracker = create_tracker(tracker_cfg)
+        self.state = VideoTrackState(video_path)
+        self.camera = camera_for_video(video_path)
+        self.gate = MotionGate() if motion_gate_enabled else None
+        self.frame_count = 0
+        profiler.begin_video(video_id)
+
+    def next_frame(self):
+        """
+        Return (frame_idx, frame cropped to the camera ROI, crop offset, moving), or None at the end.
+
+        moving is False when the motion gate lets the frame skip the detector.
+        """
+        with profiler.time('decode', self.video_id):
+            item = next(self.frames, None)
+            if item is None:
+                return None
+            frame_idx, frame = item
+            cropped, offset = self.camera.crop(frame)
+        self.frame_count += 1
+        with profiler.time('motion', self.video_id):
+            moving = self.gate is None or self.gate.is_moving(cropped)
+        return frame_idx, cropped, offset, moving
+
+    def close(self):
+        self.cap.release()
+        profiler.end_video(self.video_id, self.frame_count)
+
+
+class BatchedInferenceEngine:
+    """
+    Run the detector on frames gathered from several videos at once.
+
+    Up to max_videos videos are read in parallel; their sampled frames (at `hz` analyses per
+    second) are taken round-robin into batches of batch_size, each batch goes through a single
+    batched forward pass, and the detections are sent back to the tracker of their video in
+    frame order. Frames are cropped to the ROI of their camera, and a batch only holds frames of
+    cameras with the same inference size. Frames without motion stay in the batch so their
+    tracker is updated in order, but skip the forward pass.
+    """
+
+    def __init__(self, model, tracker_cfg, batch_size=16, max_videos=None, hz=5, conf=0.55, iou=0.6):
+        self.model = model
+        self.tracker_cfg = tracker_cfg
+        self.batch_size = batch_size
+        self.max_videos = max_videos or batch_size
+        self.hz = hz
+        self.conf = conf
+        self.iou = iou
+
+    def _open(self, video_path, video_id, fps=None):
+        """Return the stream, or the VideoProcessingError that kept it from opening."""
+        try:
+            return _VideoStream(video_path, video_id, self.hz, self.tracker_cfg, fps)
+        except Exception as e:
+            _LOGGER.error(f"{e}")
+            return e if isinstance(e, VideoProcessingError) else VideoProcessingError(str(e))
+
+    def run(self, videos, fps_index=None):
+        """
+        Process (video_path, video_id) pairs; fps_index maps video_id to the fps from video_metadata.
+
+        Yields (video_path, video_id, tracks) as each video finishes, with the same rows as
+        process_video; tracks is a VideoProcessingError if the video could not be processed.
+        """
+        pending = deque(videos)
+        active = []
+
+        while pending or active:
+            # Keep up to max_videos videos open
+            while pending and len(active) < self.max_videos:
+                video_path, video_id = pending.popleft()
+                stream = self._open(video_path, video_id, (fps_index or {}).get(video_id))
+                if isinstance(stream, VideoProcessingError):
+                    yield video_path, video_id, stream
+                else:
+                    _LOGGER.info(f"Processing video: {video_path} (ID: {video_id})")
+                    active.append(stream)
+
+            # Take frames round-robin so every video advances in each batch
+            batch = []
+            finished = []
+            imgsz = active[0].camera.imgsz if active else None
+            batchable = [stream for stream in active if stream.camera.imgsz == imgsz]
+            while len(batch) < self.batch_size and len(finished) < len(batchable):
+                for stream in batchable:
+                    if stream in finished or len(batch) >= self.batch_size:
+                        continue
+                    item = stream.next_frame()
+                    if item is None:
+                        finished.append(stream)
+                    else:
+                        batch.append((stream, *item))
+
+            failed = {}
+            if batch:
+                try:
+                    moving = [frame for _, _, frame, _, is_moving in batch if is_moving]
+                    start = time.perf_counter()
+                    results = iter(self.model.predict(moving, classes=0, conf=self.conf, iou=self.iou, imgsz=imgsz,
+                                                      verbose=False) if moving else [])
+                    # El tiempo del lote se reparte entre los cuadros que pasaron por el modelo
+                    inference_seconds = (time.perf_counter() - start) / len(moving) if moving else 0.0
+                    for stream, _, _, _, is_moving in batch:
+                        if is_moving:
+                            profiler.add('inference', inference_seconds, stream.video_id)
+                    motion_stats['frames_analyzed'] += len(moving)
+                    motion_stats['frames_skipped'] += len(batch) - len(moving)
+                    for stream, frame_idx, frame, offset, is_moving in batch:
+                        detections = next(results).boxes.cpu().numpy() if is_moving else empty_detections(frame)
+                        if stream in failed:
+                            continue
+                        try:
+                            with profiler.time('tracking', stream.video_id):
+                                tracks = stream.tracker.update(detections, frame)
+                            if len(tracks):
+                                with profiler.time('postprocess', stream.video_id):
+                                    stream.state.update(frame_idx / stream.fps, tracks[:, 4].astype(int).tolist(),
+                                                        stream.camera.to_frame(tracks[:, :4], offset))
+                        except Exception as e:
+                            _LOGGER.error(f"Tracking failed for {stream.video_path}: {e}")
+                            failed[stream] = VideoProcessingError(f"Tracking failed: {e}")
+                except Exception as e:
+                    _LOGGER.error(f"Batched inference failed: {e}")
+                    for stream, _, _, _, _ in batch:
+                        failed.setdefault(stream, VideoProcessingError(f"Batched inference failed: {e}"))
+
+            for stream in active[:]:
+                if stream in failed:
+                    active.remove(stream)
+                    stream.close()
+                    yield stream.video_path, stream.video_id, failed[stream]
+                elif stream in finished:
+                    active.remove(stream)
+                    with profiler.time('postprocess', stream.video_id):
+                        tracks = stream.state.to_rows(stream.video_id)
+                    stream.close()
+                    yield stream.video_path, stream.video_id, tracks
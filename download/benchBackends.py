@@ -0,0 +1,132 @@
+"""
+Benchmark the detector backends (PyTorch, ONNX Runtime, OpenVINO) on sample videos.
+
+Frames are sampled at the analysis rate, run through each backend and precision, and compared
+with the PyTorch fp32 baseline: detections are matched by IoU and the agreement is reported as
+2 * matched / (baseline + backend detections), so 1.0 means the same boxes.
+
+Example:
+    python benchBackends.py videosGaleria/galeria-2024-11-18\ 01:39:21.mp4 --backends pytorch onnx openvino --precisions fp32 int8
+"""
+import json
+import time
+import argparse
+import cv2
+import numpy as np
+from tracking import iter_frames
+from detectorBackends import load_detector, detector_imgsz
+from processVideos import analysis_hz, analysis_stride, model_path
+
+
+def read_frames(video_paths, hz, max_frames):
+    """Sample up to max_frames frames from the videos at the analysis rate."""
+    frames = []
+    for video_path in video_paths:
+        cap = cv2.VideoCapture(video_path)
+        fps = int(cap.get(cv2.CAP_PROP_FPS))
+        if fps > 0:
+            for _, frame in iter_frames(cap, analysis_stride(fps, hz)):
+                frames.append(frame)
+                if len(frames) >= max_frames:
+                    break
+        cap.release()
+        if len(frames) >= max_frames:
+            break
+    return frames
+
+
+def detect(model, frames, batch, imgsz):
+    """Return the person boxes of each frame and the frames per second of the backend."""
+    model.predict(frames[:batch], classes=0, conf=0.55, iou=0.6, imgsz=imgsz, verbose=False)  # warmup
+    boxes = []
+    start = time.perf_counter()
+    for i in range(0, len(frames), batch):
+        results = model.predict(frames[i:i + batch], classes=0, conf=0.55, iou=0.6, imgsz=imgsz, verbose=False)
+        boxes.extend(result.boxes.xyxy.cpu().numpy() for result in results)
+    elapsed = time.perf_counter() - start
+    return boxes, len(frames) / elapsed if elapsed else float('nan')
+
+
+def iou_matrix(a, b):
+    top_left = np.maximum(a[:, None, :2], b[None, :, :2])
+    bottom_right = np.minimum(a[:, None, 2:], b[None, :, 2:])
+    intersection = np.prod(np.clip(bottom_right - top_left, 0, None), axis=2)
+    area_a = np.prod(a[:, 2:] - a[:, :2], axis=1)
+    area_b = np.prod(b[:, 2:] - b[:, :2], axis=1)
+    return intersection / (area_a[:, None] + area_b[None, :] - intersection + 1e-9)
+
+
+def count_matches(baseline, boxes, iou_threshold):
+    """Greedily match boxes to the baseline by highest IoU."""
+    if not len(baseline) or not len(boxes):
+        return 0
+    ious = iou_matrix(baseline, boxes)
+    matched = 0
+    while True:
+        i, j = np.unravel_index(ious.argmax(), ious.shape)
+        if ious[i, j] < iou_threshold:
+            return matched
+        matched += 1
+        ious[i, :] = 0
+        ious[:, j] = 0
+
+
+def agreement(baseline, detections, iou_threshold):
+    matched = sum(count_matches(a, b, iou_threshold) for a, b in zip(baseline, detections))
+    total = sum(len(a) for a in baseline) + sum(len(b) for b in detections)
+    return 2 * matched / total if total else 1.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare detector backends against the PyTorch baseline.")
+    parser.add_argument("videos", nargs="+", help="Sample video files")
+    parser.add_argument("--weights", default=model_path, help="YOLO .pt weights")
+    parser.add_argument("--backends", nargs="+", default=["pytorch", "onnx", "openvino"], help="Backends to compare")
+    parser.add_argument("--precisions", nargs="+", default=["fp32"], help="Precisions of the exported backends")
+    parser.add_argument("--imgsz", type=int, default=detector_imgsz, help="Fixed input size of the exports")
+    parser.add_argument("--batch", type=int, default=1, help="Frames per predict call")
+    parser.add_argument("--hz", type=float, default=analysis_hz, help="Frame sampling rate")
+    parser.add_argument("--max-frames", type=int, default=300, help="Frames to run through each backend")
+    parser.add_argument("--iou-threshold", type=float, default=0.5, help="IoU to count a detection as matched")
+    parser.add_argument("--output", help="Append the results as JSON lines to this file")
+    args = parser.parse_args()
+
+    frames = read_frames(args.videos, args.hz, args.max_frames)
+    print(f"{len(frames)} frames sampled at {args.hz} Hz")
+
+    baseline, baseline_fps = detect(load_detector(args.weights, 'pytorch', 'fp32'), frames, args.batch, args.imgsz)
+    results = [{"backend": "pytorch", "precision": "fp32", "fps": round(baseline_fps, 2), "agreement": 1.0,
+                "detections": sum(len(boxes) for boxes in baseline)}]
+    for backend in args.backends:
+        for precision in args.precisions:
+            if backend == "pytorch" and precision == "fp32":
+                continue
+            try:
+                model = load_detector(args.weights, backend, precision, args.imgsz)
+            except Exception as e:
+                print(f"Skipping {backend} {precision}: {e}")
+                continue
+            detections, fps = detect(model, frames, args.batch, args.imgsz)
+            results.append({
+                "backend": backend,
+                "precision": precision,
+                "fps": round(fps, 2),
+                "agreement": round(agreement(baseline, detections, args.iou_threshold), 4),
+                "detections": sum(len(boxes) for boxes in detections),
+            })
+
+    print("backend\tprecision\tframes/s\tspeedup\tdetections\tagreement")
+    for result in results:
+        print(f"{result['backend']}\t{result['precision']}\t{result['fps']}\t"
+              f"{result['fps'] / baseline_fps:.2f}x\t{result['detections']}\t{result['agreement']}")
+
+    if args.output:
+        with open(args.output, "a") as output_file:
+            for result in results:
+                output_file.write(json.dumps({**result, "imgsz": args.imgsz, "batch": args.batch,
+                                              "frames": len(frames)}) + "\n")
+        print(f"Results appended to '{args.output}'.")
+
+
+if __name__ == "__main__":
+    main()
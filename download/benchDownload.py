@@ -0,0 +1,338 @@
+"""
+Benchmark for the download stage (AzureVideos.download_videos_by_paths plus its DB bookkeeping).
+
+Runs against a local Blob Storage stand-in, a small HTTP server that speaks the subset of the
+Blob REST API used by AzureVideos, so no production storage account is touched. The database
+is either an in-memory stand-in (default) or a local PostgreSQL, e.g. the one in
+docker-compose.yaml.
+
+Example:
+    python benchDownload.py --videos 200 --size-mb 5 --workers 1 4 8 16 --chunk-concurrency 1 4
+    python benchDownload.py --db postgres --output bench_download.jsonl
+"""
+import os
+import re
+import shutil
+import argparse
+import resource
+import tempfile
+import threading
+from email.utils import formatdate
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import unquote, urlparse, parse_qs
+from xml.sax.saxutils import escape
+import psycopg2
+import psycopg2.extensions
+from dotenv import load_dotenv
+from download import AzureVideos
+from benchHarness import run_configurations, print_table, append_results
+
+ACCOUNT_NAME = "devstoreaccount1"
+CONTAINER_NAME = "crowdcounting"
+
+
+class BlobStandInHandler(BaseHTTPRequestHandler):
+    """Serve GET (with x-ms-range), HEAD and container listing for blobs kept in memory."""
+
+    protocol_version = "HTTP/1.1"
+    blobs = {}
+    last_modified = formatdate(usegmt=True)
+
+    def log_message(self, format, *args):
+        pass
+
+    def _blob_name(self):
+        path = self.path.split("?", 1)[0]
+        prefix = f"/{ACCOUNT_NAME}/{CONTAINER_NAME}/"
+        if not path.startswith(prefix):
+            return None
+        return unquote(path[len(prefix):])
+
+    def _send(self, status, headers, body=b""):
+        self.send_response(status)
+        headers.setdefault("Content-Length", str(len(body)))
+        headers.setdefault("x-ms-version", "2021-08-06")
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.end_headers()
+        if body and self.command != "HEAD":
+            self.wfile.write(body)
+
+    def _blob_headers(self, size):
+        return {
+            "ETag": '"0x8D000000000000"',
+            "Last-Modified": self.last_modified,
+            "x-ms-blob-type": "BlockBlob",
+            "x-ms-creation-time": self.last_modified,
+            "Content-Type": "video/mp4",
+            "Accept-Ranges": "bytes",
+            "x-ms-blob-content-length": str(size),
+        }
+
+    def do_HEAD(self):
+        name = self._blob_name()
+        if name not in self.blobs:
+            self._send(404, {"x-ms-error-code": "BlobNotFound"})
+            return
+        headers = self._blob_headers(len(self.blobs[name]))
+        headers["Content-Length"] = str(len(self.blobs[name]))
+        self._send(200, headers)
+
+    def do_GET(self):
+        if "comp=list" in self.path:
+            self._list_blobs()
+            return
+        name = self._blob_name()
+        if name not in self.blobs:
+            self._send(404, {"x-ms-error-code": "BlobNotFound"})
+            return
+        data = self.blobs[name]
+        headers = self._blob_headers(len(data))
+        byte_range = self.headers.get("x-ms-range") or self.headers.get("Range")
+        match = re.match(r"bytes=(\d+)-(\d*)", byte_range or "")
+        if not match:
+            self._send(200, headers, data)
+            return
+        start = int(match.group(1))
+        end = min(int(match.group(2)) if match.group(2) else len(data) - 1, len(data) - 1)
+        if start >= len(data):
+            self._send(416, {"x-ms-error-code": "InvalidRange", "Content-Range": f"bytes */{len(data)}"})
+            return
+        headers["Content-Range"] = f"bytes {start}-{end}/{len(data)}"
+        self._send(206, headers, data[start:end + 1])
+
+    def _list_blobs(self):
+        query = parse_qs(urlparse(self.path).query)
+        prefix = query.get("prefix", [""])[0]
+        items = "".join(
+            f"<Blob><Name>{escape(name)}</Name><Properties><Last-Modified>{self.last_modified}</Last-Modified>"
+            f"<Content-Length>{len(data)}</Content-Length><BlobType>BlockBlob</BlobType></Properties></Blob>"
+            for name, data in sorted(self.blobs.items()) if name.startswith(prefix)
+        )
+        body = (f'<?xml version="1.0" encoding="utf-8"?><EnumerationResults ContainerName="{CONTAINER_NAME}">'
+                f"<Prefix>{escape(prefix)}</Prefix><Blobs>{items}</Blobs><NextMarker /></EnumerationResults>").encode()
+        self._send(200, {"Content-Type": "application/xml"}, body)
+
+
+def start_blob_stand_in(blobs):
+    """Start the Blob stand-in on a free local port and return (server, account_url)."""
+    BlobStandInHandler.blobs = blobs
+    server = ThreadingHTTPServer(("127.0.0.1", 0), BlobStandInHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/{ACCOUNT_NAME}"
+
+
+def generate_videos(count, size_bytes):
+    """Generate synthetic blobs named like the Galería recordings."""
+    payload = os.urandom(size_bytes)
+    return {f"galeria-2024-01-01 00:{i // 60 % 60:02d}:{i % 60:02d}-{i:06d}.mp4": payload for i in range(count)}
+
+
+class QueryCounter:
+    """Process-wide counter of executed database statements."""
+
+    count = 0
+    lock = threading.Lock()
+
+    @classmethod
+    def increment(cls):
+        with cls.lock:
+            cls.count += 1
+
+
+class CountingCursor(psycopg2.extensions.cursor):
+    """psycopg2 cursor that counts executed statements."""
+
+    def execute(self, query, vars=None):
+        QueryCounter.increment()
+        return super().execute(query, vars)
+
+
+class MemoryCursor:
+    """Minimal stand-in for the psycopg2 cursor API used by AzureVideos."""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self._result = []
+        self._pending_rows = []
+
+    def mogrify(self, template, args):
+        # Used by execute_values; remember the row and hand back a placeholder fragment
+        self._pending_rows.append(args)
+        return b"(?)"
+
+    def execute(self, query, vars=None):
+        QueryCounter.increment()
+        query = query.decode() if isinstance(query, bytes) else query
+        table = self.connection.video_recorded
+        if query.lstrip().upper().startswith("INSERT INTO VIDEO_RECORDED"):
+            with self.connection.lock:
+                for row in self._pending_rows or [vars]:
+                    table.add(row[0])
+            self._result = []
+        elif "= ANY(" in query:
+            self._result = [(video_id,) for video_id in vars[0] if video_id in table]
+        elif "WHERE id = %s" in query:
+            self._result = [(vars[0],)] if vars[0] in table else []
+        elif query.lstrip().upper().startswith("SELECT ID FROM VIDEO_RECORDED"):
+            self._result = [(video_id,) for video_id in list(table)]
+        else:
+            self._result = []
+        self._pending_rows = []
+
+    def fetchone(self):
+        return self._result[0] if self._result else None
+
+    def fetchall(self):
+        return list(self._result)
+
+    def close(self):
+        pass
+
+
+class MemoryConnection:
+    encoding = "UTF8"
+
+    def __init__(self, pool):
+        self.video_recorded = pool.video_recorded
+        self.lock = pool.lock
+
+    def cursor(self):
+        return MemoryCursor(self)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+
+class MemoryPool:
+    """In-memory stand-in for ThreadedConnectionPool holding the video_recorded ids."""
+
+    def __init__(self):
+        self.video_recorded = set()
+        self.lock = threading.Lock()
+
+    def getconn(self):
+        return MemoryConnection(self)
+
+    def putconn(self, conn):
+        pass
+
+    def closeall(self):
+        pass
+
+
+def reset_postgres(db_config, video_ids):
+    """Remove the synthetic videos from a previous run."""
+    conn = psycopg2.connect(**db_config)
+    cursor = conn.cursor()
+    # Rows referencing video_recorded go first (video_metadata is filled by --probe runs)
+    for table in ("video_metadata", "video_processing"):
+        cursor.execute("SELECT to_regclass(%s);", (table,))
+        if cursor.fetchone()[0] is not None:
+            cursor.execute(f"DELETE FROM {table} WHERE video_id = ANY(%s);", (list(video_ids),))
+    cursor.execute("DELETE FROM video_recorded WHERE id = ANY(%s);", (list(video_ids),))
+    conn.commit()
+    cursor.close()
+    conn.close()
+
+
+def run_configuration(account_url, paths, args, workers, chunk_concurrency, result_queue):
+    """Run one download pass in a child process so peak RSS is measured per configuration."""
+    QueryCounter.count = 0
+    output_dir = tempfile.mkdtemp(prefix="bench_download_")
+    db_pool = None
+    db_config = None
+    if args.db == "memory":
+        db_pool = MemoryPool()
+    else:
+        db_config = {
+            "dbname": os.getenv("DB_NAME"),
+            "user": os.getenv("DB_USER"),
+            "password": os.getenv("DB_PASSWORD"),
+            "host": os.getenv("DB_HOST"),
+            "port": os.getenv("DB_PORT"),
+        }
+        reset_postgres(db_config, [os.path.basename(path) for path in paths])
+        db_config["cursor_factory"] = CountingCursor
+
+    client = AzureVideos(
+        output_dir=output_dir,
+        account_url=account_url,
+        db_config=db_config,
+        db_pool=db_pool,
+        max_workers=workers,
+        chunk_size=args.chunk_size_kb * 1024,
+        chunk_concurrency=chunk_concurrency,
+        parallel_threshold=args.parallel_threshold_kb * 1024,
+        probe_metadata=args.probe,
+    )
+    try:
+        stats = client.download_videos_by_paths(paths, batch_size=args.batch_size)
+    finally:
+        client.close()
+        shutil.rmtree(output_dir, ignore_errors=True)
+
+    elapsed = max(stats["seconds"], 1e-9)
+    downloaded = max(stats["downloaded"], 1)
+    result_queue.put({
+        "workers": workers,
+        "chunk_concurrency": chunk_concurrency,
+        "db": args.db,
+        "probe": args.probe,
+        "videos": len(paths),
+        "video_size_mb": args.size_mb,
+        "downloaded": stats["downloaded"],
+        "failed": stats["failed"],
+        "seconds": round(stats["seconds"], 3),
+        "videos_per_s": round(stats["downloaded"] / elapsed, 2),
+        "mb_per_s": round(stats["bytes"] / (1024 * 1024) / elapsed, 2),
+        "db_queries_per_video": round(QueryCounter.count / downloaded, 3),
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    })
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the download stage against local stand-ins.")
+    parser.add_argument("--videos", type=int, default=100, help="Number of synthetic videos")
+    parser.add_argument("--size-mb", type=float, default=2.0, help="Size of each synthetic video in MB")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4, 8], help="Concurrent downloads to compare")
+    parser.add_argument("--chunk-concurrency", type=int, nargs="+", default=[1], help="Parallel ranged reads per blob")
+    parser.add_argument("--chunk-size-kb", type=int, default=4096, help="Bytes per ranged read, in KB")
+    parser.add_argument("--parallel-threshold-kb", type=int, default=32768, help="Blob size above which ranged reads run in parallel, in KB")
+    parser.add_argument("--batch-size", type=int, default=4, help="Batch size of the sequential mode")
+    parser.add_argument("--probe", action="store_true", help="Probe each download into video_metadata (the synthetic blobs are not playable videos)")
+    parser.add_argument("--db", choices=["memory", "postgres"], default="memory", help="Database stand-in")
+    parser.add_argument("--account-url", help="Use an existing emulator (e.g. Azurite) instead of the built-in stand-in")
+    parser.add_argument("--timeout", type=float, help="Seconds before a configuration is given up (default: no limit)")
+    parser.add_argument("--output", help="Append the results as JSON lines to this file")
+    args = parser.parse_args()
+
+    load_dotenv()
+    blobs = generate_videos(args.videos, int(args.size_mb * 1024 * 1024))
+    paths = sorted(blobs)
+    server = None
+    account_url = args.account_url
+    if not account_url:
+        server, account_url = start_blob_stand_in(blobs)
+    print(f"Blob endpoint: {account_url} ({len(paths)} videos of {args.size_mb} MB)")
+
+    configurations = [(f"workers={workers} chunk_concurrency={chunk_concurrency}",
+                       (account_url, paths, args, workers, chunk_concurrency))
+                      for workers in args.workers for chunk_concurrency in args.chunk_concurrency]
+    results = run_configurations(run_configuration, configurations, args.timeout)
+
+    if server:
+        server.shutdown()
+
+    header = ["workers", "chunk_concurrency", "videos_per_s", "mb_per_s", "db_queries_per_video", "peak_rss_mb", "failed"]
+    print_table(header, [[result[key] for key in header] for result in results])
+
+    if args.output:
+        append_results(results, args.output)
+
+if __name__ == "__main__":
+    main()
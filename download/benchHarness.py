@@ -0,0 +1,72 @@
+"""
+Shared harness of the benchmarks (benchDownload.py, benchProcess.py).
+
+Each configuration runs in its own forked process, so peak RSS is measured per configuration,
+and sends its result dict back on a queue. Results are printed as a table and can be appended
+as JSON lines to a file.
+"""
+import json
+import queue
+import multiprocessing
+
+
+def wait_for_result(process, result_queue, timeout=None, poll_interval=1.0):
+    """
+    Result of a configuration's process, or None if it died or ran past timeout seconds.
+
+    A child killed before putting its result (e.g. by the OOM killer) would otherwise leave
+    the parent blocked on the queue forever.
+    """
+    waited = 0.0
+    while True:
+        try:
+            return result_queue.get(timeout=poll_interval)
+        except queue.Empty:
+            waited += poll_interval
+        if not process.is_alive():
+            # The result may have been flushed to the queue just before the process exited
+            try:
+                return result_queue.get(timeout=poll_interval)
+            except queue.Empty:
+                print(f"Configuration process exited with code {process.exitcode} without a result.")
+                return None
+        if timeout and waited >= timeout:
+            print(f"Configuration process still running after {timeout}s, terminating it.")
+            process.terminate()
+            return None
+
+
+def run_configurations(target, configurations, timeout=None):
+    """
+    Run target(*args, result_queue) in a forked process for each (label, args) configuration.
+
+    Returns the results in order, leaving out the configurations that failed.
+    """
+    results = []
+    context = multiprocessing.get_context("fork")
+    for label, args in configurations:
+        result_queue = context.Queue()
+        process = context.Process(target=target, args=(*args, result_queue))
+        process.start()
+        result = wait_for_result(process, result_queue, timeout)
+        process.join()
+        if result is None:
+            print(f"Configuration {label} failed.")
+            continue
+        results.append(result)
+    return results
+
+
+def print_table(header, rows):
+    """Print tab-separated rows under a header."""
+    print("\t".join(header))
+    for row in rows:
+        print("\t".join(str(value) for value in row))
+
+
+def append_results(results, output):
+    """Append the results as JSON lines to the output file."""
+    with open(output, "a") as output_file:
+        for result in results:
+            output_file.write(json.dumps(result) + "\n")
+    print(f"Results appended to '{output}'.")
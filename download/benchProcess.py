@@ -0,0 +1,189 @@
+"""
+Throughput benchmark for the processing hot path (process_video and the batched engine).
+
+Synthetic corridor videos with moving rectangles as people are generated with OpenCV, then
+processed with the real YOLO weights or with a deterministic stub detector (bright blobs found
+with contours), for each worker count. Tracks are computed but not written to the database, so
+no database is needed. Each configuration runs in its own process so peak RSS is measured per
+configuration; results are appended as JSON lines with the commit they were measured on.
+
+Example:
+    python benchProcess.py --videos 16 --seconds 20 --people 8 --workers 1 2 4 8 --output bench_process.jsonl
+    python benchProcess.py --detector model --weights best.pt --batch-size 16 --workers 4
+"""
+import os
+import time
+import shutil
+import argparse
+import resource
+import tempfile
+import subprocess
+import multiprocessing
+import cv2
+import numpy as np
+from ultralytics.engine.results import Results
+from tracking import VideoProcessingError
+import processVideos
+from processVideos import init_worker, iter_video_tracks, limit_threads, order_by_size, pool_settings
+from benchHarness import run_configurations, print_table, append_results
+
+
+def generate_video(path, width, height, fps, seconds, people, seed):
+    """Write a corridor video with `people` rectangles walking across it at different speeds."""
+    rng = np.random.default_rng(seed)
+    background = np.tile(np.linspace(30, 70, width, dtype=np.uint8), (height, 1))
+    background = cv2.cvtColor(background, cv2.COLOR_GRAY2BGR)
+    person_w, person_h = max(8, width // 40), max(20, height // 8)
+    lanes = rng.uniform(0.15, 0.85 - person_h / height, people) * height
+    speeds = rng.uniform(0.5, 2.0, people) * width / (fps * 4) * rng.choice([-1, 1], people)
+    starts = rng.uniform(0, width, people)
+
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), fps, (width, height))
+    for frame_idx in range(int(fps * seconds)):
+        frame = background.copy()
+        xs = (starts + speeds * frame_idx) % (width + person_w) - person_w
+        for x, y in zip(xs.astype(int), lanes.astype(int)):
+            cv2.rectangle(frame, (x, y), (x + person_w, y + person_h), (230, 230, 230), -1)
+        writer.write(frame)
+    writer.release()
+    return int(fps * seconds)
+
+
+class StubDetector:
+    """Deterministic stand-in for the YOLO model: every bright blob is a person."""
+
+    names = {0: "person"}
+
+    def predict(self, frames, conf=0.55, **kwargs):
+        frames = frames if isinstance(frames, list) else [frames]
+        results = []
+        for frame in frames:
+            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+            _, mask = cv2.threshold(gray, 127, 255, cv2.THRESH_BINARY)
+            contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+            boxes = [[x, y, x + w, y + h, 0.9, 0] for x, y, w, h in map(cv2.boundingRect, contours)]
+            boxes = np.array(boxes, dtype=np.float32).reshape(-1, 6)
+            results.append(Results(frame, path="", names=self.names, boxes=boxes))
+        return results
+
+
+def init_stub_worker(threads=None):
+    limit_threads(threads)
+    processVideos._MODEL = StubDetector()
+
+
+def process_task(videos, batch_size):
+    """Pool task: run the tracker over the videos without writing to the database."""
+    video_files, video_ids = zip(*videos)
+    tracks = 0
+    for video_path, video_id, data in iter_video_tracks(list(video_files), list(video_ids), batch_size):
+        try:
+            if data is None:
+                data = processVideos.process_video(video_path, video_id)
+            elif isinstance(data, VideoProcessingError):
+                raise data
+        except VideoProcessingError as e:
+            print(f"Error for {video_path}: {e}")
+            continue
+        tracks += len(data)
+    return tracks
+
+
+def process_task_args(args):
+    return process_task(*args)
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_configuration(videos, frames, args, workers, result_queue):
+    """Process every video with `workers` processes; runs in a child process."""
+    _, threads = pool_settings(workers, args.threads)
+    initializer = init_stub_worker if args.detector == "stub" else init_worker
+    if args.detector == "model":
+        processVideos.model_path = args.weights
+    task_size = max(1, args.batch_size)
+    tasks = [videos[i:i + task_size] for i in range(0, len(videos), task_size)]
+
+    start = time.perf_counter()
+    with multiprocessing.Pool(processes=workers, initializer=initializer, initargs=(threads,)) as pool:
+        tracks = sum(pool.imap_unordered(process_task_args, [(task, args.batch_size) for task in tasks]))
+    elapsed = time.perf_counter() - start
+
+    result_queue.put({
+        "commit": git_commit(),
+        "detector": args.detector,
+        "workers": workers,
+        "threads_per_worker": threads,
+        "batch_size": args.batch_size,
+        "videos": len(videos),
+        "resolution": f"{args.width}x{args.height}",
+        "fps": args.fps,
+        "seconds_per_video": args.seconds,
+        "people": args.people,
+        "analysis_hz": processVideos.analysis_hz,
+        "tracks": tracks,
+        "seconds": round(elapsed, 3),
+        "videos_per_s": round(len(videos) / elapsed, 3),
+        "frames_per_s": round(frames / elapsed, 2),
+        "realtime_factor": round(len(videos) * args.seconds / elapsed, 2),
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "peak_worker_rss_mb": round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1),
+    })
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark process_video on synthetic videos.")
+    parser.add_argument("--videos", type=int, default=8, help="Number of synthetic videos")
+    parser.add_argument("--width", type=int, default=1280, help="Video width")
+    parser.add_argument("--height", type=int, default=720, help="Video height")
+    parser.add_argument("--fps", type=int, default=30, help="Video frame rate")
+    parser.add_argument("--seconds", type=float, default=10, help="Length of each video")
+    parser.add_argument("--people", type=int, default=5, help="Moving people per video")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the synthetic videos")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4], help="Worker counts to compare")
+    parser.add_argument("--threads", type=int, help="torch/OpenCV threads per worker (default: derived from the CPUs)")
+    parser.add_argument("--batch-size", type=int, default=0, help="Frames per forward pass of the batched engine (0 = off)")
+    parser.add_argument("--detector", choices=["stub", "model"], default="stub", help="Stub detector or the YOLO weights")
+    parser.add_argument("--weights", default=processVideos.model_path, help="YOLO weights for --detector model")
+    parser.add_argument("--video-dir", help="Keep the synthetic videos in this directory")
+    parser.add_argument("--timeout", type=float, help="Seconds before a configuration is given up (default: no limit)")
+    parser.add_argument("--output", help="Append the results as JSON lines to this file")
+    args = parser.parse_args()
+
+    video_dir = args.video_dir or tempfile.mkdtemp(prefix="bench_process_")
+    os.makedirs(video_dir, exist_ok=True)
+    frames = 0
+    video_files = []
+    for i in range(args.videos):
+        video_path = os.path.join(video_dir, f"bench-{i:04d}.mp4")
+        frames += generate_video(video_path, args.width, args.height, args.fps, args.seconds, args.people, args.seed + i)
+        video_files.append(video_path)
+    videos = order_by_size(video_files, [os.path.basename(path) for path in video_files])
+    print(f"{args.videos} videos of {args.seconds}s at {args.width}x{args.height}, {args.fps} fps, "
+          f"{args.people} people ({args.detector} detector)")
+
+    try:
+        configurations = [(f"workers={workers}", (videos, frames, args, workers)) for workers in args.workers]
+        results = run_configurations(run_configuration, configurations, args.timeout)
+    finally:
+        if not args.video_dir:
+            shutil.rmtree(video_dir, ignore_errors=True)
+
+    baseline = results[0]["frames_per_s"] if results else 0
+    header = ["workers", "threads_per_worker", "videos_per_s", "frames_per_s", "realtime_factor", "peak_worker_rss_mb", "tracks"]
+    print_table(header + ["scaling"], [
+        [result[key] for key in header] + [f"{result['frames_per_s'] / baseline if baseline else float('nan'):.2f}x"]
+        for result in results
+    ])
+
+    if args.output:
+        append_results(results, args.output)
+
+if __name__ == "__main__":
+    main()
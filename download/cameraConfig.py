@@ -0,0 +1,96 @@
+"""
+Per-camera detector settings: region of interest and inference size.
+
+cameras.json maps a camera name (the prefix of the video file name, e.g. "galeria" for
+"galeria-2024-11-18 01:39:21.mp4") to its settings:
+
+    {"galeria": {"roi": [x1, y1, x2, y2], "polygon": [[x, y], ...], "imgsz": 480}}
+
+roi is a box in original-frame pixels; polygon (optional) also blanks out the pixels of its
+bounding box that fall outside it. Frames are cropped before inference and the boxes are moved
+back to original-frame coordinates, so centroids and directions do not depend on the ROI.
+Cameras without an entry use the full frame at DETECTOR_IMGSZ.
+"""
+import os
+import json
+import logging
+import cv2
+import numpy as np
+from detectorBackends import detector_imgsz
+from dotenv import load_dotenv
+
+_LOGGER = logging.getLogger('video_processor')
+
+# Cargar variables de entorno antes de leer la configuracion
+load_dotenv('.env')
+
+cameras_config_path = os.getenv('CAMERAS_CONFIG',
+                                os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cameras.json'))
+
+
+class CameraConfig:
+    """Crop settings of one camera."""
+
+    def __init__(self, name, roi=None, polygon=None, imgsz=None):
+        self.name = name
+        self.polygon = np.array(polygon, dtype=np.int32) if polygon else None
+        if roi is None and self.polygon is not None:
+            x, y, w, h = cv2.boundingRect(self.polygon)
+            roi = [x, y, x + w, y + h]
+        self.roi = [int(v) for v in roi] if roi else None
+        self.imgsz = int(imgsz or detector_imgsz)
+        self._mask = None
+
+    def crop(self, frame):
+        """Return (cropped frame, (x, y) offset of the crop in the original frame)."""
+        if self.roi is None:
+            return frame, (0, 0)
+        height, width = frame.shape[:2]
+        x1, y1 = max(0, self.roi[0]), max(0, self.roi[1])
+        x2, y2 = min(width, self.roi[2]), min(height, self.roi[3])
+        cropped = frame[y1:y2, x1:x2]
+        if self.polygon is not None:
+            if self._mask is None or self._mask.shape != cropped.shape[:2]:
+                self._mask = np.zeros(cropped.shape[:2], dtype=np.uint8)
+                cv2.fillPoly(self._mask, [self.polygon - [x1, y1]], 255)
+            cropped = cv2.bitwise_and(cropped, cropped, mask=self._mask)
+        return cropped, (x1, y1)
+
+    @staticmethod
+    def to_frame(boxes_xyxy, offset):
+        """Move xyxy boxes from crop coordinates back to original-frame coordinates."""
+        if offset == (0, 0):
+            return boxes_xyxy
+        return boxes_xyxy + np.array([offset[0], offset[1], offset[0], offset[1]], dtype=boxes_xyxy.dtype)
+
+
+def camera_name(video_path):
+    return os.path.basename(video_path).split('-')[0]
+
+
+_CAMERAS = None
+
+
+def load_cameras(config_path=None):
+    """Read cameras.json into {name: CameraConfig}."""
+    config_path = config_path or cameras_config_path
+    if not os.path.exists(config_path):
+        return {}
+    try:
+        with open(config_path, 'r') as config_file:
+            config = json.load(config_file)
+    except (OSError, ValueError) as e:
+        _LOGGER.error(f"Could not read camera config '{config_path}': {e}")
+        return {}
+    return {name: CameraConfig(name, **settings) for name, settings in config.items()}
+
+
+def camera_for_video(video_path):
+    """Camera settings for a video, by the prefix of its file name."""
+    global _CAMERAS
+    if _CAMERAS is None:
+        _CAMERAS = load_cameras()
+    name = camera_name(video_path)
+    if name not in _CAMERAS:
+        _CAMERAS[name] = CameraConfig(name)
+    return _CAMERAS[name]
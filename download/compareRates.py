@@ -0,0 +1,65 @@
+"""
+Compare strided analysis (ANALYSIS_HZ) against full-rate tracking on sample videos.
+
+For each video it reports the number of tracks and the count of each direction at both rates,
+so the accuracy of the strided mode can be checked before changing the analysis rate.
+
+Example:
+    python compareRates.py videosGaleria/galeria-2024-11-18\ 01:39:21.mp4 --hz 5 --output compare_rates.jsonl
+"""
+import os
+import json
+import time
+import argparse
+from collections import Counter
+from processVideos import process_video, analysis_hz
+
+
+def summarize(tracks):
+    directions = Counter(track['direction'] for track in tracks)
+    return {"tracks": len(tracks), "directions": dict(directions)}
+
+
+def compare_video(video_path, hz):
+    video_id = os.path.basename(video_path)
+    start = time.perf_counter()
+    full_rate = process_video(video_path, video_id, full_rate=True, hz=hz)
+    full_rate_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    strided = process_video(video_path, video_id, hz=hz)
+    strided_seconds = time.perf_counter() - start
+
+    return {
+        "video": video_id,
+        "hz": hz,
+        "full_rate": {**summarize(full_rate), "seconds": round(full_rate_seconds, 2)},
+        "strided": {**summarize(strided), "seconds": round(strided_seconds, 2)},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare strided and full-rate tracking output.")
+    parser.add_argument("videos", nargs="+", help="Video files to compare")
+    parser.add_argument("--hz", type=float, default=analysis_hz, help="Analysis rate of the strided mode")
+    parser.add_argument("--output", help="Append the results as JSON lines to this file")
+    args = parser.parse_args()
+
+    results = [compare_video(video_path, args.hz) for video_path in args.videos]
+
+    print("video\tfull tracks\tstrided tracks\tfull directions\tstrided directions\tspeedup")
+    for result in results:
+        full_rate, strided = result["full_rate"], result["strided"]
+        speedup = full_rate["seconds"] / strided["seconds"] if strided["seconds"] else float("nan")
+        print(f"{result['video']}\t{full_rate['tracks']}\t{strided['tracks']}\t"
+              f"{full_rate['directions']}\t{strided['directions']}\t{speedup:.1f}x")
+
+    if args.output:
+        with open(args.output, "a") as output_file:
+            for result in results:
+                output_file.write(json.dumps(result) + "\n")
+        print(f"Results appended to '{args.output}'.")
+
+
+if __name__ == "__main__":
+    main()
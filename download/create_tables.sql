@@ -15,5 +15,46 @@ CREATE TABLE tracks (
     duration DOUBLE PRECISION,
     direction VARCHAR(255),
     CONSTRAINT tracks_video_id_fkey FOREIGN KEY (video_id)
+        REFERENCES video_recorded(id),
+    -- Clave de la insercion idempotente; su indice tambien sirve las busquedas por video_id
+    CONSTRAINT tracks_video_id_track_id_key UNIQUE (video_id, track_id)
+);
+
+-- Crear la tabla video_processing (estado de procesamiento de cada video)
+CREATE TABLE video_processing (
+    video_id VARCHAR(255) NOT NULL,
+    status VARCHAR(32) NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    claimed_by VARCHAR(255),
+    claimed_at TIMESTAMP,
+    last_error TEXT,
+    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    CONSTRAINT video_processing_pkey PRIMARY KEY (video_id),
+    CONSTRAINT video_processing_video_id_fkey FOREIGN KEY (video_id)
+        REFERENCES video_recorded(id)
+);
+
+CREATE INDEX video_processing_status_idx ON video_processing (status, updated_at);
+
+-- Crear la tabla video_metadata (lectura del encabezado de cada video al descargarlo)
+CREATE TABLE video_metadata (
+    video_id VARCHAR(255) NOT NULL,
+    fps DOUBLE PRECISION,
+    frame_count INTEGER,
+    duration DOUBLE PRECISION,
+    width INTEGER,
+    height INTEGER,
+    codec VARCHAR(16),
+    size_bytes BIGINT,
+    valid BOOLEAN NOT NULL,
+    probed_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    CONSTRAINT video_metadata_pkey PRIMARY KEY (video_id),
+    CONSTRAINT video_metadata_video_id_fkey FOREIGN KEY (video_id)
         REFERENCES video_recorded(id)
 );
+
+-- Migracion unica de una base existente, a ejecutar a mano (processVideos.init_db se niega a procesar sin la clave):
+-- quitar tracks duplicados, conservando el mas antiguo, y agregar la clave unica
+-- DELETE FROM tracks a USING tracks b
+--     WHERE a.video_id = b.video_id AND a.track_id = b.track_id AND a.id > b.id;
+-- ALTER TABLE tracks ADD CONSTRAINT tracks_video_id_track_id_key UNIQUE (video_id, track_id);
@@ -0,0 +1,113 @@
+"""
+Detector backends for the YOLO weights: PyTorch, ONNX Runtime or OpenVINO.
+
+ONNX and OpenVINO models are exported once from the .pt weights and cached under
+DETECTOR_CACHE_DIR, keyed by the hash of the weights, the input size and the precision (and
+for int8 the hash of the calibration dataset YAML), so a new best.pt is exported again and
+every worker reuses the same export. Exports have a fixed input size (DETECTOR_IMGSZ) and a
+dynamic batch dimension for the batched inference engine.
+
+Backend and precision are selected with DETECTOR_BACKEND (pytorch, onnx, openvino) and
+DETECTOR_PRECISION (fp32, fp16, int8). On CPU only OpenVINO exports fp16 and int8 models:
+ultralytics ignores half for ONNX on CPU and has no int8 ONNX export, so those combinations are
+rejected instead of running an fp32 model under another label. INT8 exports are calibrated on
+DETECTOR_CALIBRATION_DATA, an ultralytics dataset YAML with frames of the Galería cameras, and
+int8 is rejected without it rather than calibrated on ultralytics' default dataset.
+"""
+import os
+import fcntl
+import shutil
+import hashlib
+import logging
+from ultralytics import YOLO
+from dotenv import load_dotenv
+
+_LOGGER = logging.getLogger('video_processor')
+
+BACKENDS = ('pytorch', 'onnx', 'openvino')
+PRECISIONS = ('fp32', 'fp16', 'int8')
+# Precisiones que cada backend realmente ejecuta en CPU
+BACKEND_PRECISIONS = {'pytorch': ('fp32',), 'onnx': ('fp32',), 'openvino': PRECISIONS}
+
+# Cargar variables de entorno antes de leer la configuracion
+load_dotenv('.env')
+
+detector_backend = os.getenv('DETECTOR_BACKEND', 'pytorch')
+detector_precision = os.getenv('DETECTOR_PRECISION', 'fp32')
+detector_imgsz = int(os.getenv('DETECTOR_IMGSZ', '640'))
+detector_cache_dir = os.getenv('DETECTOR_CACHE_DIR', 'model_cache')
+calibration_data = os.getenv('DETECTOR_CALIBRATION_DATA')
+
+
+def weights_hash(weights_path, length=16):
+    """Hash of the weights file (or calibration dataset YAML) contents, used to key the cached exports."""
+    digest = hashlib.sha256()
+    with open(weights_path, 'rb') as weights_file:
+        for block in iter(lambda: weights_file.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()[:length]
+
+
+def check_backend(backend, precision):
+    """Raise ValueError unless the backend runs the precision on CPU (int8 also needs calibration data)."""
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown detector backend '{backend}', expected one of {BACKENDS}")
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown detector precision '{precision}', expected one of {PRECISIONS}")
+    if precision not in BACKEND_PRECISIONS[backend]:
+        raise ValueError(f"The {backend} backend only runs {'/'.join(BACKEND_PRECISIONS[backend])} on CPU; "
+                         f"use openvino for {precision}")
+    if precision == 'int8' and not calibration_data:
+        raise ValueError("int8 exports need DETECTOR_CALIBRATION_DATA, a dataset YAML with frames of the cameras")
+
+
+def export_path(weights_path, backend, precision, imgsz, cache_dir):
+    name = os.path.splitext(os.path.basename(weights_path))[0]
+    key = f"{name}-{weights_hash(weights_path)}-{imgsz}-{precision}"
+    if precision == 'int8':
+        key += f"-{weights_hash(calibration_data)}"
+    if backend == 'onnx':
+        return os.path.join(cache_dir, f"{key}.onnx")
+    return os.path.join(cache_dir, f"{key}_openvino_model")
+
+
+def export_model(weights_path, backend, precision='fp32', imgsz=640, cache_dir=None):
+    """
+    Return the path of the cached export of weights_path, exporting it first if needed.
+
+    An exclusive lock on the cache directory keeps concurrent workers from exporting the same
+    model twice.
+    """
+    check_backend(backend, precision)
+    cache_dir = cache_dir or detector_cache_dir
+    target = export_path(weights_path, backend, precision, imgsz, cache_dir)
+    if os.path.exists(target):
+        return target
+
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(os.path.join(cache_dir, '.export.lock'), 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        if os.path.exists(target):
+            return target
+        _LOGGER.info(f"Exporting '{weights_path}' to {backend} ({precision}, imgsz {imgsz})")
+        kwargs = {'format': backend, 'imgsz': imgsz, 'dynamic': True, 'device': 'cpu'}
+        if precision == 'fp16':
+            kwargs['half'] = True
+        elif precision == 'int8':
+            kwargs['int8'] = True
+            kwargs['data'] = calibration_data
+        exported = YOLO(weights_path).export(**kwargs)
+        # ultralytics escribe la exportacion junto a los pesos; se mueve al cache
+        shutil.move(str(exported), target)
+    return target
+
+
+def load_detector(weights_path, backend=None, precision=None, imgsz=None, cache_dir=None):
+    """Load the detector for weights_path with the selected backend."""
+    backend = backend or detector_backend
+    precision = precision or detector_precision
+    check_backend(backend, precision)
+    if backend == 'pytorch':
+        return YOLO(weights_path)
+    model_file = export_model(weights_path, backend, precision, imgsz or detector_imgsz, cache_dir)
+    return YOLO(model_file, task='detect')
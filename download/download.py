@@ -2,20 +2,213 @@
 
 import os
 import json
+import time
+import threading
+from contextlib import contextmanager
+from itertools import islice
+from datetime import datetime, timedelta, timezone
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+import requests
+from azure.core import MatchConditions
 from azure.storage.blob import BlobServiceClient
 from dotenv import load_dotenv
 from tqdm import tqdm
-import psycopg2
+from psycopg2.pool import ThreadedConnectionPool
+from psycopg2.extras import execute_values
+from videoMetadata import ensure_metadata_table, probe_video, save_metadata
+
+
+class VideoRecordedWriter:
+    """
+    Buffer video_recorded inserts, with the probed video_metadata rows, and flush them in batches.
+
+    The ids of rows whose insert failed are kept in failed_ids, so the caller can count those
+    videos as failed and hold back the discovery watermark.
+    """
+
+    INSERT_QUERY = """
+    INSERT INTO video_recorded (id, camera, date_observed, path)
+    VALUES %s
+    ON CONFLICT (id) DO NOTHING;
+    """
+    INSERT_TEMPLATE = "(%s, NULL, CURRENT_TIMESTAMP, %s)"
+
+    def __init__(self, db_connection, batch_size=100, flush_interval=5.0):
+        """
+        Args:
+            db_connection: Callable returning a context manager that yields a pooled connection.
+            batch_size (int): Number of buffered rows that triggers a flush.
+            flush_interval (float): Seconds since the last flush that trigger a flush.
+        """
+        self._db_connection = db_connection
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._rows = []
+        self.failed_ids = []
+        self._lock = threading.Lock()
+        self._last_flush = time.monotonic()
+
+    def add(self, video_id, path, metadata=None):
+        """Queue a row, with the probe_video result if any, and flush if the size or time threshold is reached."""
+        with self._lock:
+            self._rows.append((video_id, path, metadata))
+            should_flush = (len(self._rows) >= self.batch_size
+                            or time.monotonic() - self._last_flush >= self.flush_interval)
+        if should_flush:
+            self.flush()
+
+    def flush(self):
+        """Insert every buffered row with a single multi-row statement."""
+        with self._lock:
+            rows, self._rows = self._rows, []
+            self._last_flush = time.monotonic()
+        if not rows:
+            return
+        try:
+            with self._db_connection() as conn:
+                cursor = conn.cursor()
+                execute_values(cursor, self.INSERT_QUERY, [(video_id, path) for video_id, path, _ in rows],
+                               template=self.INSERT_TEMPLATE, page_size=len(rows))
+                conn.commit()
+                cursor.close()
+        except Exception as e:
+            print(f"Error updating database ({len(rows)} videos not recorded): {e}")
+            with self._lock:
+                self.failed_ids.extend(video_id for video_id, _, _ in rows)
+            return
+        # The metadata goes in its own transaction, so a failure there never drops video_recorded rows
+        probed = [(video_id, metadata) for video_id, _, metadata in rows if metadata is not None]
+        if not probed:
+            return
+        try:
+            with self._db_connection() as conn:
+                cursor = conn.cursor()
+                save_metadata(cursor, probed)
+                conn.commit()
+                cursor.close()
+        except Exception as e:
+            print(f"Error saving the metadata of {len(probed)} videos: {e}")
+
+
+def load_listing_watermark(state_file="blob_watermark.json"):
+    """Load the newest blob last-modified time seen by a previous listing, or None."""
+    try:
+        with open(state_file, "r") as json_file:
+            return datetime.fromisoformat(json.load(json_file)["watermark"])
+    except (IOError, ValueError, KeyError):
+        return None
+
+
+def save_listing_watermark(watermark, state_file="blob_watermark.json"):
+    """Persist the newest blob last-modified time, replacing the state file atomically."""
+    temp_file = state_file + ".tmp"
+    with open(temp_file, "w") as json_file:
+        json.dump({"watermark": watermark.isoformat()}, json_file)
+    os.replace(temp_file, state_file)
+
+
+def commit_orion_watermark(state_file="orion_watermark.json"):
+    """Commit the pending watermark of orionManager.py's last incremental sync, if any."""
+    pending_file = state_file + ".pending"
+    if os.path.exists(pending_file):
+        os.replace(pending_file, state_file)
+        print(f"Orion watermark committed to '{state_file}'.")
+
+
+def commit_discovery(stats, listing_watermark=None):
+    """Move the discovery watermark forward, only once every discovered video is on disk."""
+    if not stats or stats["failed"]:
+        return
+    if listing_watermark:
+        save_listing_watermark(listing_watermark)
+    elif os.getenv("DISCOVERY_SOURCE", "orion") != "blob":
+        commit_orion_watermark(os.getenv("ORION_WATERMARK_FILE", "orion_watermark.json"))
+
+
+def _read_marker(marker_file):
+    """Run token in one of orionManager.py's NDJSON marker files, or None."""
+    try:
+        with open(marker_file, "r") as token_file:
+            return token_file.read().strip() or None
+    except IOError:
+        return None
+
+
+def read_paths_ndjson(input_file, follow=False, poll_interval=1.0):
+    """
+    Yield paths from a newline-delimited JSON file.
+
+    With follow, wait for a producer run (the token in "<input_file>.start") that has not been
+    read to the end before, keep reading while the producer appends to the file and stop once
+    "<input_file>.done" holds the same token and every line has been read. The token is then
+    saved to "<input_file>.consumed", so a downloader started before the next run of
+    orionManager.py waits for it instead of reading the previous file again.
+    """
+    start_marker = input_file + ".start"
+    done_marker = input_file + ".done"
+    consumed_marker = input_file + ".consumed"
+    run_token = None
+    if follow:
+        consumed_token = _read_marker(consumed_marker)
+        run_token = _read_marker(start_marker)
+        while run_token is None or run_token == consumed_token:
+            time.sleep(poll_interval)
+            run_token = _read_marker(start_marker)
+    if not os.path.exists(input_file):
+        return
+
+    with open(input_file, "r") as ndjson_file:
+        pending_line = ""
+        while True:
+            line = ndjson_file.readline()
+            if line:
+                pending_line += line
+                # A line without its newline is still being written
+                if pending_line.endswith("\n"):
+                    if pending_line.strip():
+                        yield json.loads(pending_line)
+                    pending_line = ""
+                continue
+            if not follow:
+                break
+            if _read_marker(done_marker) == run_token:
+                # Read whatever was appended before the marker was created
+                follow = False
+                continue
+            time.sleep(poll_interval)
+        if pending_line.strip():
+            yield json.loads(pending_line)
+
+    if run_token is not None:
+        with open(consumed_marker, "w") as token_file:
+            token_file.write(run_token)
 
 
 class AzureVideos:
-    def __init__(self, output_dir: str, sas_token=None, account_url=None, default_container="crowdcounting", verbose=False, db_config=None):
+    def __init__(self, output_dir: str, sas_token=None, account_url=None, default_container="crowdcounting", verbose=False, db_config=None, max_workers=1,
+                 db_batch_size=100, db_flush_interval=5.0, chunk_size=4 * 1024 * 1024, chunk_concurrency=1,
+                 parallel_threshold=32 * 1024 * 1024, db_pool=None, probe_metadata=True):
         self.output_dir = output_dir
         self.sas_token = sas_token
         self.account_url = account_url or "https://cienciaciudades2024.blob.core.windows.net"
         self.default_container = default_container
-        self.blob_service_client = BlobServiceClient(self.account_url, credential=sas_token)
+        self.max_workers = max(1, max_workers)
+        # Streaming settings: every request reads at most chunk_size bytes, and blobs larger than
+        # parallel_threshold are fetched with chunk_concurrency ranged reads in flight
+        self.chunk_size = chunk_size
+        self.chunk_concurrency = max(1, chunk_concurrency)
+        self.parallel_threshold = parallel_threshold
+        # Size the HTTP connection pool so concurrent downloads do not discard connections
+        http_session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=max(10, self.max_workers * self.chunk_concurrency))
+        http_session.mount("https://", adapter)
+        http_session.mount("http://", adapter)
+        self.blob_service_client = BlobServiceClient(self.account_url, credential=sas_token, session=http_session,
+                                                     max_single_get_size=chunk_size, max_chunk_get_size=chunk_size)
         self.verbose = verbose
+        # Probe fps, frame count, duration, resolution and codec of each downloaded video into video_metadata
+        self.probe_metadata = probe_metadata
+        self._metadata_table_ready = False
         db_name = os.getenv("DB_NAME")
         user = os.getenv("DB_USER")
         password = os.getenv("DB_PASSWORD")
@@ -29,100 +222,440 @@ class AzureVideos:
             "host": host,
             "port": port
         }
+        # Connection pool shared by the download threads, created on first use unless one is given
+        self._db_pool = db_pool
+        self._db_pool_lock = threading.Lock()
+        # ThreadedConnectionPool raises PoolError when exhausted; borrowers wait for a free connection instead
+        self._db_pool_slots = threading.BoundedSemaphore(self.max_workers + 1)
+        self.status_writer = VideoRecordedWriter(self._db_connection, batch_size=db_batch_size, flush_interval=db_flush_interval)
 
-    def _connect_to_db(self):
-        """Connect to PostgreSQL database."""
-        return psycopg2.connect(**self.db_config)
+    @contextmanager
+    def _db_connection(self):
+        """Borrow a connection from the PostgreSQL pool, waiting while every connection is in use."""
+        with self._db_pool_lock:
+            if self._db_pool is None:
+                # One connection per download thread plus one for the status writer
+                self._db_pool = ThreadedConnectionPool(1, self.max_workers + 1, **self.db_config)
+        with self._db_pool_slots:
+            conn = self._db_pool.getconn()
+            try:
+                yield conn
+            finally:
+                # The pool rolls back any transaction left open before reusing the connection
+                self._db_pool.putconn(conn)
+
+    def _prepare_metadata_table(self):
+        """Create video_metadata if needed; probing is turned off when that is not possible."""
+        if not self.probe_metadata or self._metadata_table_ready:
+            return
+        try:
+            with self._db_connection() as conn:
+                ensure_metadata_table(conn)
+            self._metadata_table_ready = True
+        except Exception as e:
+            print(f"Could not create the video_metadata table, videos will not be probed: {e}")
+            self.probe_metadata = False
+
+    def close(self):
+        """Flush pending status writes and close every pooled connection."""
+        self.status_writer.flush()
+        with self._db_pool_lock:
+            if self._db_pool is not None:
+                self._db_pool.closeall()
+                self._db_pool = None
 
     def is_video_downloaded(self, video_id):
         """Check if a video has already been downloaded."""
         try:
-            conn = self._connect_to_db()
-            cursor = conn.cursor()
+            with self._db_connection() as conn:
+                cursor = conn.cursor()
 
-            # Query to check if the video exists in the table
-            query = "SELECT id FROM video_recorded WHERE id = %s;"
-            cursor.execute(query, (video_id,))
-            result = cursor.fetchone()
+                # Query to check if the video exists in the table
+                query = "SELECT id FROM video_recorded WHERE id = %s;"
+                cursor.execute(query, (video_id,))
+                result = cursor.fetchone()
 
-            cursor.close()
-            conn.close()
+                cursor.close()
 
             return result is not None
         except Exception as e:
             print(f"Error checking video in database: {e}")
             return False
 
-    def mark_video_as_downloaded(self, video_id):
-        """Mark a video as downloaded in the database."""
-        try:
-            conn = self._connect_to_db()
+    def load_downloaded_ids(self, video_ids=None, chunk_size=None):
+        """
+        Load the set of video ids already present in video_recorded.
+
+        By default the whole id column is read in a single query. For very large tables,
+        pass the candidate video_ids and a chunk_size to filter them with id = ANY(%s) instead.
+        """
+        with self._db_connection() as conn:
             cursor = conn.cursor()
+            known_ids = set()
+            if video_ids is None or not chunk_size:
+                cursor.execute("SELECT id FROM video_recorded;")
+                known_ids.update(row[0] for row in cursor.fetchall())
+            else:
+                video_ids = list(video_ids)
+                for i in range(0, len(video_ids), chunk_size):
+                    cursor.execute("SELECT id FROM video_recorded WHERE id = ANY(%s);", (video_ids[i:i + chunk_size],))
+                    known_ids.update(row[0] for row in cursor.fetchall())
+            cursor.close()
+            return known_ids
 
-            # Insert or update the record in the video_recorded table
-            query = """
-            INSERT INTO video_recorded (id, camera, date_observed, path)
-            VALUES (%s, NULL, CURRENT_TIMESTAMP, %s)
-            ON CONFLICT (id) DO NOTHING;
-            """
-            cursor.execute(query, (video_id, video_id))
-            conn.commit()
+    def mark_video_as_downloaded(self, video_id, metadata=None):
+        """Mark a video as downloaded in the database. The insert is buffered, see VideoRecordedWriter."""
+        self.status_writer.add(video_id, video_id, metadata)
 
-            cursor.close()
-            conn.close()
+    def list_videos(self, container_name: str = "", prefix: str = "galeria", since=None, lookback_days=7):
+        """
+        Yield name, size and last-modified time of the videos in the container, in one listing pass.
+
+        With since (an aware datetime, e.g. the newest known blob timestamp), only blobs modified
+        after it are returned. Blob names start with "<prefix>-YYYY-MM-DD", so the listing is
+        narrowed to one name prefix per day from lookback_days before since until today; a blob
+        recorded earlier than that but uploaded late (e.g. by a camera that was offline) is only
+        found by a full listing, lookback_days=0, which filters the whole prefix on last_modified.
+        """
+        container_name = self.default_container if not container_name else container_name
+        container_client = self.blob_service_client.get_container_client(container_name)
+
+        if since is None or lookback_days <= 0:
+            name_prefixes = [prefix]
+        else:
+            first_day = (since - timedelta(days=lookback_days)).date()
+            days = (datetime.now(timezone.utc).date() - first_day).days + 1
+            name_prefixes = [f"{prefix}-{first_day + timedelta(days=i):%Y-%m-%d}" for i in range(max(days, 1))]
+
+        for name_prefix in name_prefixes:
+            for blob in container_client.list_blobs(name_starts_with=name_prefix):
+                if since is not None and blob.last_modified <= since:
+                    continue
+                yield {"name": blob.name, "size": blob.size, "last_modified": blob.last_modified}
+
+    def _download_blob(self, container_client, path, check_db=True, expected_size=None):
+        """Download a single blob. Returns the number of bytes written, or None if it was skipped."""
+        video_id = os.path.basename(path)
+
+        # Check if the video is already downloaded
+        if check_db and self.is_video_downloaded(video_id):
+            print(f"Video {video_id} is already downloaded. Skipping.")
+            return None
+
+        download_file_path = os.path.join(self.output_dir, path)
+        os.makedirs(os.path.dirname(download_file_path), exist_ok=True)
+
+        blob_client = container_client.get_blob_client(path)
+
+        # Download the blob
+        fetched_bytes = self._download_to_file(blob_client, download_file_path)
+        if expected_size is not None and os.path.getsize(download_file_path) != expected_size:
+            os.remove(download_file_path)
+            raise IOError(f"Size mismatch for '{path}': expected {expected_size} bytes from the listing")
+        if self.verbose:
+            print(f"Blob '{path}' has been downloaded to '{download_file_path}'.")
+
+        # Mark video as downloaded in the database
+        metadata = probe_video(download_file_path) if self.probe_metadata else None
+        self.mark_video_as_downloaded(video_id, metadata)
+        return fetched_bytes
+
+    def _download_to_file(self, blob_client, download_file_path):
+        """
+        Stream a blob to disk and return the number of bytes fetched.
+
+        Chunks are appended to a ".part" file that is renamed atomically once complete. The blob's
+        ETag is saved next to it in a ".part.etag" file, and an existing ".part" file is resumed
+        with a ranged read from its current size only while the blob still has that ETag, so a
+        restart does not re-fetch bytes already on disk nor splice two versions of a blob.
+        """
+        part_path = download_file_path + ".part"
+        etag_path = part_path + ".etag"
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        etag = None
+
+        if offset:
+            properties = blob_client.get_blob_properties()
+            etag = self._read_part_etag(etag_path)
+            if etag != properties.etag or offset > properties.size:
+                # Stale partial file from a different blob version, start over
+                self._remove_part(part_path)
+                offset = 0
+                etag = None
+            elif offset == properties.size:
+                os.replace(part_path, download_file_path)
+                os.remove(etag_path)
+                return 0
+            elif self.verbose:
+                print(f"Resuming '{download_file_path}' from byte {offset} of {properties.size}.")
+
+        with open(part_path, "ab") as part_file:
+            if offset:
+                # Fails with ResourceModifiedError if the blob changed since the properties were read
+                download_stream = blob_client.download_blob(offset=offset, etag=etag,
+                                                            match_condition=MatchConditions.IfNotModified)
+            else:
+                download_stream = blob_client.download_blob()
+                etag = download_stream.properties.etag
+                with open(etag_path, "w") as etag_file:
+                    etag_file.write(etag)
+            # For ranged reads the stream size is the remaining length, not the blob size
+            blob_size = offset + download_stream.size
+            chunks = download_stream.chunks()
+            if self.chunk_concurrency > 1 and blob_size - offset > self.parallel_threshold:
+                # Keep the first response and fetch the rest as parallel ranged reads
+                part_file.write(next(chunks))
+                self._download_ranges(blob_client, part_file, part_file.tell(), blob_size, etag)
+            else:
+                for chunk in chunks:
+                    part_file.write(chunk)
+
+        if os.path.getsize(part_path) != blob_size:
+            self._remove_part(part_path)
+            raise IOError(f"Incomplete download of '{download_file_path}', expected {blob_size} bytes")
+        os.replace(part_path, download_file_path)
+        os.remove(etag_path)
+        return blob_size - offset
+
+    @staticmethod
+    def _read_part_etag(etag_path):
+        """ETag the ".part" file was started with, or None for files left by older versions."""
+        try:
+            with open(etag_path) as etag_file:
+                return etag_file.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    @staticmethod
+    def _remove_part(part_path):
+        """Delete a partial download and its ETag file."""
+        for path in (part_path, part_path + ".etag"):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def _download_ranges(self, blob_client, part_file, start, end, etag=None):
+        """
+        Fetch bytes [start, end) of a blob with parallel ranged reads.
+
+        Ranges are downloaded in windows of chunk_concurrency and appended in order, so the
+        ".part" file never has holes and stays resumable. Memory is bounded by one window.
+        With etag, every range must come from that version of the blob.
+        """
+        match_condition = MatchConditions.IfNotModified if etag else None
+
+        def fetch(byte_range):
+            range_start, length = byte_range
+            return blob_client.download_blob(offset=range_start, length=length, etag=etag,
+                                              match_condition=match_condition).readall()
+
+        ranges = [(position, min(self.chunk_size, end - position)) for position in range(start, end, self.chunk_size)]
+        with ThreadPoolExecutor(max_workers=self.chunk_concurrency) as executor:
+            for i in range(0, len(ranges), self.chunk_concurrency):
+                for data in executor.map(fetch, ranges[i:i + self.chunk_concurrency]):
+                    part_file.write(data)
+
+    def _filter_downloaded(self, paths, index_chunk_size=None):
+        """
+        Drop the paths whose videos are already in video_recorded.
+
+        Returns the pending paths, or None if the index could not be loaded and every
+        video has to be checked on its own.
+        """
+        try:
+            known_ids = self.load_downloaded_ids([os.path.basename(path) for path in paths], index_chunk_size)
         except Exception as e:
-            print(f"Error updating database: {e}")
+            print(f"Error loading downloaded videos index, checking each video instead: {e}")
+            return None
+        return [path for path in paths if os.path.basename(path) not in known_ids]
+
+    def download_videos_by_paths(self, paths, container_name: str = "", batch_size: int = 4, preload_index=True,
+                                 index_chunk_size=None, expected_sizes=None, disk_budget=None):
+        """
+        Download videos from Azure Blob Storage.
 
-    def download_videos_by_paths(self, paths, container_name: str = "", batch_size: int = 4):
-        """Download videos from Azure Blob Storage."""
+        paths can be a list or any iterable, such as read_paths_ndjson. Iterables are consumed in
+        chunks of index_chunk_size (1000 by default), so the full list is never held in memory and
+        downloads start while the producer is still writing paths.
+        With the client's max_workers > 1 the blobs are fetched concurrently by a bounded thread
+        pool (the database pool is sized for it), otherwise they are fetched one after another in batches of batch_size.
+        With preload_index the already downloaded ids are loaded before each chunk (see
+        load_downloaded_ids) instead of querying the database once per path.
+        expected_sizes maps paths to their size in a blob listing (see list_videos); a download
+        whose size does not match is discarded and counted as failed.
+        disk_budget (see pipeline.DiskBudget) is acquired before each download and released when it
+        ends; while the output directory is over budget, downloads wait for processing to free space.
+        Returns a dict with the download statistics.
+        """
         container_name = self.default_container if not container_name else container_name
         container_client = self.blob_service_client.get_container_client(container_name)
+        max_workers = self.max_workers
+        self._prepare_metadata_table()
+
+        stats = {"downloaded": 0, "skipped": 0, "failed": 0, "bytes": 0}
+        failed_writes = len(self.status_writer.failed_ids)
+        start_time = time.perf_counter()
+
+        if isinstance(paths, (list, tuple)):
+            path_chunks = [list(paths)]
+            total_videos = len(paths)
+        else:
+            index_chunk_size = index_chunk_size or 1000
+            path_iterator = iter(paths)
+            path_chunks = iter(lambda: list(islice(path_iterator, index_chunk_size)), [])
+            total_videos = None
 
-        total_videos = len(paths)
-        downloaded_count = 0
+        progress = tqdm(total=total_videos, desc="Downloading videos")
 
-        for i in range(0, total_videos, batch_size):
-            batch_paths = paths[i:i + batch_size]
-            print(f"Downloading batch {i // batch_size + 1} ({len(batch_paths)} videos)...")
+        def record(path, result=None, error=None):
+            if error is not None:
+                print(f"Error downloading blob {path}: {error}")
+                stats["failed"] += 1
+            elif result is None:
+                stats["skipped"] += 1
+            else:
+                stats["downloaded"] += 1
+                stats["bytes"] += result
+            progress.update(1)
 
-            for path in tqdm(batch_paths, desc="Downloading videos in batch"):
-                video_id = os.path.basename(path)
+        if max_workers > 1:
+            print(f"Downloading videos with {max_workers} concurrent workers...")
+        executor = ThreadPoolExecutor(max_workers=max_workers) if max_workers > 1 else None
+        in_flight = {}
+        # Ids already queued in this call: a repeated path would stream into the same ".part" file
+        queued_ids = set()
+        batch_number = 0
+
+        def fetch(path, check_db, expected_size):
+            try:
+                return self._download_blob(container_client, path, check_db, expected_size)
+            finally:
+                if disk_budget:
+                    disk_budget.release(path)
+
+        def admit(path, expected_size):
+            if disk_budget:
+                # While waiting, record what is on disk so processing can pick it up and free space
+                disk_budget.acquire(path, expected_size, on_wait=self.status_writer.flush)
+
+        def drain(limit):
+            # Wait until at most `limit` downloads are in flight
+            while len(in_flight) > limit:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    path = in_flight.pop(future)
+                    try:
+                        record(path, result=future.result())
+                    except Exception as e:
+                        record(path, error=e)
+
+        try:
+            for chunk in path_chunks:
+                unique_paths = []
+                for path in dict.fromkeys(chunk):
+                    if os.path.basename(path) not in queued_ids:
+                        queued_ids.add(os.path.basename(path))
+                        unique_paths.append(path)
+                if len(unique_paths) < len(chunk):
+                    stats["skipped"] += len(chunk) - len(unique_paths)
+                    progress.update(len(chunk) - len(unique_paths))
+                    chunk = unique_paths
+                check_db = True
+                if preload_index:
+                    pending_paths = self._filter_downloaded(chunk, index_chunk_size)
+                    if pending_paths is not None:
+                        skipped = len(chunk) - len(pending_paths)
+                        stats["skipped"] += skipped
+                        progress.update(skipped)
+                        print(f"Skipping {skipped} of {len(chunk)} videos already downloaded.")
+                        chunk = pending_paths
+                        check_db = False
 
-                # Check if the video is already downloaded
-                if self.is_video_downloaded(video_id):
-                    print(f"Video {video_id} is already downloaded. Skipping.")
+                if executor:
+                    for path in chunk:
+                        drain(2 * max_workers)
+                        expected_size = expected_sizes.get(path) if expected_sizes else None
+                        admit(path, expected_size)
+                        in_flight[executor.submit(fetch, path, check_db, expected_size)] = path
                     continue
 
-                download_file_path = os.path.join(self.output_dir, path)
-                os.makedirs(os.path.dirname(download_file_path), exist_ok=True)
+                for i in range(0, len(chunk), batch_size):
+                    batch_paths = chunk[i:i + batch_size]
+                    batch_number += 1
+                    print(f"Downloading batch {batch_number} ({len(batch_paths)} videos)...")
 
-                try:
-                    blob_client = container_client.get_blob_client(path)
+                    for path in batch_paths:
+                        try:
+                            expected_size = expected_sizes.get(path) if expected_sizes else None
+                            admit(path, expected_size)
+                            record(path, result=fetch(path, check_db, expected_size))
+                        except Exception as e:
+                            record(path, error=e)
 
-                    # Download the blob
-                    with open(download_file_path, "wb") as download_file:
-                        download_stream = blob_client.download_blob()
-                        download_file.write(download_stream.readall())
-                    if self.verbose:
-                        print(f"Blob '{path}' has been downloaded to '{download_file_path}'.")
+                    print(f"Batch {batch_number} completed.")
+            drain(0)
+        finally:
+            if executor:
+                executor.shutdown()
+            progress.close()
 
-                    # Mark video as downloaded in the database
-                    self.mark_video_as_downloaded(video_id)
-                    downloaded_count += 1
-                except Exception as e:
-                    print(f"Error downloading blob {path}: {e}")
+        # Record the videos still waiting in the write buffer
+        self.status_writer.flush()
+        # Videos on disk but not in video_recorded would never be processed: count them as failed
+        stats["failed"] += len(self.status_writer.failed_ids) - failed_writes
 
-            print(f"Batch {i // batch_size + 1} completed.")
+        stats["seconds"] = time.perf_counter() - start_time
+        self._report_throughput(stats)
+        return stats
 
+    @staticmethod
+    def _report_throughput(stats):
+        """Print aggregate download throughput."""
+        elapsed = max(stats["seconds"], 1e-9)
+        megabytes = stats["bytes"] / (1024 * 1024)
+        print(
+            f"Downloaded {stats['downloaded']} videos ({megabytes:.1f} MB) in {elapsed:.1f}s, "
+            f"skipped {stats['skipped']}, failed {stats['failed']}: "
+            f"{megabytes / elapsed:.2f} MB/s, {stats['downloaded'] / elapsed:.2f} videos/s"
+        )
 
-if __name__ == "__main__":
-    load_dotenv()
 
-    # Load paths from the JSON file
-    with open("filtered_paths.json", "r") as json_file:
-        filtered_paths = json.load(json_file)
+def discover_paths(azure_client):
+    """
+    Paths to download, from a listing of the container (DISCOVERY_SOURCE=blob) or from
+    orionManager.py's output (DOWNLOAD_PATHS_FILE).
+
+    Returns (paths, expected sizes by path or None, listing watermark or None).
+    """
+    expected_sizes = None
+    listing_watermark = None
+    if os.getenv("DISCOVERY_SOURCE", "orion") == "blob":
+        # Discover the videos by listing the container instead of reading orionManager.py's output
+        since = load_listing_watermark() if os.getenv("DISCOVERY_INCREMENTAL", "1") == "1" else None
+        # Days of recordings listed before the watermark, for late uploads (0 = list the whole prefix)
+        lookback_days = int(os.getenv("DISCOVERY_LOOKBACK_DAYS", "7"))
+        blobs = list(azure_client.list_videos(prefix="galeria", since=since, lookback_days=lookback_days))
+        filtered_paths = [blob["name"] for blob in blobs]
+        expected_sizes = {blob["name"]: blob["size"] for blob in blobs}
+        if blobs:
+            listing_watermark = max(blob["last_modified"] for blob in blobs)
+        total_megabytes = sum(expected_sizes.values()) / (1024 * 1024)
+        print(f"Listed {len(filtered_paths)} videos ({total_megabytes:.1f} MB) modified after {since or 'the beginning'}.")
+    else:
+        paths_file = os.getenv("DOWNLOAD_PATHS_FILE", "filtered_paths.json")
+        if paths_file.endswith(".ndjson"):
+            # Stream the paths, optionally while orionManager.py is still writing them
+            filtered_paths = read_paths_ndjson(paths_file, follow=os.getenv("DOWNLOAD_FOLLOW", "0") == "1")
+        else:
+            # Load paths from the JSON file
+            with open(paths_file, "r") as json_file:
+                filtered_paths = json.load(json_file)
+
+            print(f"Total paths to download: {len(filtered_paths)}")
+    return filtered_paths, expected_sizes, listing_watermark
+
 
-    print(f"Total paths to download: {len(filtered_paths)}")
+if __name__ == "__main__":
+    load_dotenv()
 
     # Configure Azure Blob Storage
     account_url = os.getenv("AZURE_STORAGE_ACCOUNT_URL")
@@ -135,14 +668,30 @@ if __name__ == "__main__":
         "port": os.getenv("DB_PORT")
     }
 
+    # Number of blobs fetched concurrently (1 keeps the sequential batch mode)
+    max_workers = int(os.getenv("DOWNLOAD_WORKERS", "8"))
+    # Filter candidates with id = ANY(%s) in chunks of this size instead of loading every known id
+    index_chunk_size = int(os.getenv("DOWNLOAD_INDEX_CHUNK_SIZE", "0")) or None
+    # Parallel ranged reads per blob for videos larger than the parallel threshold
+    chunk_concurrency = int(os.getenv("DOWNLOAD_CHUNK_CONCURRENCY", "1"))
+
     azure_client = AzureVideos(
         output_dir="videosGaleria",
         sas_token=sas_token,
         account_url=account_url,
         verbose=True,
-        db_config=db_config
+        db_config=db_config,
+        max_workers=max_workers,
+        chunk_concurrency=chunk_concurrency,
+        probe_metadata=os.getenv("DOWNLOAD_PROBE", "1") == "1"
     )
 
-    # Download videos using paths
-    azure_client.download_videos_by_paths(filtered_paths, batch_size=4)
+    filtered_paths, expected_sizes, listing_watermark = discover_paths(azure_client)
 
+    # Download videos using paths
+    try:
+        stats = azure_client.download_videos_by_paths(filtered_paths, batch_size=4, index_chunk_size=index_chunk_size,
+                                                      expected_sizes=expected_sizes)
+        commit_discovery(stats, listing_watermark)
+    finally:
+        azure_client.close()
@@ -1,4 +1,6 @@
+import os
 import subprocess
+from dotenv import load_dotenv
 
 def run_script(script_path):
     try:
@@ -9,6 +11,9 @@ def run_script(script_path):
         print(f"Error executing {script_path}: {e}")
 
 if __name__ == "__main__":
+    # MASTER_PIPELINE y la configuracion de los scripts pueden venir de .env; los scripts heredan el entorno
+    load_dotenv()
+
     # Ruta para filtrar los videos
     filter_videos = "/home/crowdcounting/galeria-arlo/download/orionManager.py"
     # Ruta del script de descarga
@@ -18,14 +23,21 @@ if __name__ == "__main__":
     
     #Ruta para actualizar la db
     update_db = "/home/crowdcounting/galeria-arlo/download/arloManager.py"
+    # Ruta del script que descarga y procesa a la vez
+    pipeline_script = "/home/crowdcounting/galeria-arlo/download/pipeline.py"
 
     run_script(filter_videos)
-    # Ejecutar el script de descarga
-    print("Starting download script...")
-    run_script(download_script)
+    if os.getenv("MASTER_PIPELINE", "0") == "1":
+        # Descarga y procesamiento solapados, con el disco limitado por PIPELINE_BUDGET_GB/PIPELINE_BUDGET_FILES
+        print("Starting pipeline script...")
+        run_script(pipeline_script)
+    else:
+        # Ejecutar el script de descarga
+        print("Starting download script...")
+        run_script(download_script)
 
-    # Ejecutar el script de procesamiento
-    print("Starting processing script...")
-    run_script(process_script)
+        # Ejecutar el script de procesamiento
+        print("Starting processing script...")
+        run_script(process_script)
 
     run_script(update_db)
\ No newline at end of file
@@ -0,0 +1,101 @@
+"""
+Motion gate: skip the detector on footage where nothing moves.
+
+Frames are downscaled to MOTION_WIDTH pixels wide, converted to grayscale and blurred, and
+compared with the previous analysed frame; a frame has motion when more than
+MOTION_MIN_FRACTION of its pixels change by more than MOTION_PIXEL_THRESHOLD gray levels.
+After motion the detector keeps running for MOTION_HOLD_FRAMES frames so tracks can end
+normally. Before processing, a video is sampled at MOTION_PREPASS_HZ and skipped entirely when
+none of those frames has motion.
+
+The gate is opt-in: set MOTION_GATE=1 to enable it; by default the detector runs on every
+analysed frame and no video is skipped.
+"""
+import os
+from collections import Counter
+import cv2
+import numpy as np
+from tracking import iter_frames
+from dotenv import load_dotenv
+
+# Cargar variables de entorno antes de leer la configuracion
+load_dotenv('.env')
+
+motion_gate_enabled = os.getenv('MOTION_GATE', '0') == '1'
+motion_width = int(os.getenv('MOTION_WIDTH', '160'))
+motion_pixel_threshold = int(os.getenv('MOTION_PIXEL_THRESHOLD', '25'))
+motion_min_fraction = float(os.getenv('MOTION_MIN_FRACTION', '0.002'))
+motion_hold_frames = int(os.getenv('MOTION_HOLD_FRAMES', '3'))
+motion_prepass_hz = float(os.getenv('MOTION_PREPASS_HZ', '1'))
+
+# Contadores del proceso: cuadros analizados/omitidos y videos omitidos (ver take_motion_stats)
+motion_stats = Counter()
+
+
+class MotionGate:
+    """Frame differencing on downscaled grayscale frames."""
+
+    def __init__(self, width=None, pixel_threshold=None, min_fraction=None, hold_frames=None):
+        self.width = width or motion_width
+        self.pixel_threshold = motion_pixel_threshold if pixel_threshold is None else pixel_threshold
+        self.min_fraction = motion_min_fraction if min_fraction is None else min_fraction
+        self.hold_frames = motion_hold_frames if hold_frames is None else hold_frames
+        self.previous = None
+        self.remaining = 0
+
+    def _prepare(self, frame):
+        height, width = frame.shape[:2]
+        size = (self.width, max(1, round(height * self.width / width)))
+        small = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+        return cv2.GaussianBlur(cv2.cvtColor(small, cv2.COLOR_BGR2GRAY), (5, 5), 0)
+
+    def changed_fraction(self, frame):
+        """Share of pixels that changed since the previous frame (None for the first frame)."""
+        gray = self._prepare(frame)
+        previous, self.previous = self.previous, gray
+        if previous is None or previous.shape != gray.shape:
+            return None
+        return np.count_nonzero(cv2.absdiff(gray, previous) > self.pixel_threshold) / gray.size
+
+    def is_moving(self, frame):
+        """Whether the detector should run on this frame; the first frame always runs."""
+        changed = self.changed_fraction(frame)
+        if changed is None or changed >= self.min_fraction:
+            self.remaining = self.hold_frames
+            return True
+        if self.remaining > 0:
+            self.remaining -= 1
+            return True
+        return False
+
+
+def video_has_motion(video_path, camera=None, hz=None):
+    """
+    Sample the video at `hz` and stop at the first frame with motion.
+
+    Videos that cannot be read are reported as moving, so the error surfaces in process_video.
+    """
+    cap = cv2.VideoCapture(video_path)
+    try:
+        fps = int(cap.get(cv2.CAP_PROP_FPS)) if cap.isOpened() else 0
+        if fps <= 0:
+            return True
+        gate = MotionGate()
+        sampled = 0
+        for _, frame in iter_frames(cap, max(1, int(fps // (hz or motion_prepass_hz)))):
+            if camera is not None:
+                frame, _ = camera.crop(frame)
+            changed = gate.changed_fraction(frame)
+            sampled += 1
+            if changed is not None and changed >= gate.min_fraction:
+                return True
+        return sampled < 2
+    finally:
+        cap.release()
+
+
+def take_motion_stats():
+    """Return the counters of this process and reset them."""
+    stats = dict(motion_stats)
+    motion_stats.clear()
+    return stats
@@ -1,13 +1,23 @@
 import os
+import re
 import time
+import uuid
+import threading
 import requests
 import json
-from typing import List
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Iterator, List, Optional
+from requests.adapters import HTTPAdapter
 from dotenv import load_dotenv
 
 
+NGSI_LD_CONTEXT_LINK = ('<https://uri.etsi.org/ngsi-ld/v1/ngsi-ld-core-context>; '
+                        'rel="http://www.w3.org/ns/json-ld#context"; type="application/ld+json"')
+
+
 class OrionManager:
-    def __init__(self, client_id: str, client_secret: str, keycloak_url: str, orion_url: str):
+    def __init__(self, client_id: str, client_secret: str, keycloak_url: str, orion_url: str, max_workers: int = 4):
         """
         Initialize the OrionManager class.
 
@@ -16,6 +26,7 @@ class OrionManager:
             client_secret (str): Keycloak client secret.
             keycloak_url (str): Keycloak token URL.
             orion_url (str): Orion Context Broker base URL.
+            max_workers (int): Number of entity pages fetched concurrently.
         """
         self.client_id = client_id
         self.client_secret = client_secret
@@ -23,6 +34,18 @@ class OrionManager:
         self.orion_url = orion_url.rstrip("/")
         self.token = None
         self.token_expiry = 0
+        self.max_workers = max(1, max_workers)
+        self._token_lock = threading.Lock()
+
+        # Keep-alive session shared by every request, with one pooled connection per worker
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(10, self.max_workers))
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers.update({
+            "Content-Type": "application/json",
+            "Accept": "application/json",
+        })
 
     def obtain_token(self):
         """
@@ -36,7 +59,7 @@ class OrionManager:
 
         if self.token_expiry < time.time():
             try:
-                response = requests.post(self.keycloak_url, data=token_data)
+                response = self.session.post(self.keycloak_url, data=token_data)
                 response.raise_for_status()
                 token_json = response.json()
                 self.token = token_json.get("access_token")
@@ -51,60 +74,393 @@ class OrionManager:
         """
         Get a valid token, refreshing it if necessary.
         """
-        if not self.token or time.time() > self.token_expiry:
-            self.obtain_token()
-        return self.token
+        with self._token_lock:
+            if not self.token or time.time() > self.token_expiry:
+                self.obtain_token()
+            return self.token
 
-    def fetch_and_filter_entities(self, entity_type: str, path_prefix: str = "galeria", batch_size: int = 1000) -> List[str]:
+    def refresh_token(self, expired_token: str) -> str:
+        """
+        Refresh the token after a 401, unless another thread already did it.
+
+        Args:
+            expired_token (str): Token that was rejected by the broker.
+
+        Returns:
+            str: A valid token.
+        """
+        with self._token_lock:
+            if self.token == expired_token:
+                self.token_expiry = 0
+                self.obtain_token()
+            return self.token
+
+    def _request(self, method: str, url: str, **kwargs) -> list:
+        """
+        Send an authenticated request to the broker, refreshing the token once if it has expired.
+
+        Args:
+            method (str): HTTP method.
+            url (str): Request URL.
+            **kwargs: Extra arguments for requests (params, json, headers).
+
+        Returns:
+            list: Decoded JSON response.
+        """
+        headers = kwargs.pop("headers", {})
+        token = self.get_token()
+        response = self.session.request(method, url, headers={**headers, "Authorization": f"Bearer {token}"}, **kwargs)
+        if response.status_code == 401:
+            print("⚠️ Token expired, refreshing token and retrying...")
+            token = self.refresh_token(token)
+            response = self.session.request(method, url, headers={**headers, "Authorization": f"Bearer {token}"}, **kwargs)
+
+        response.raise_for_status()
+        return response.json()
+
+    def _get_entities(self, params: dict) -> list:
+        """
+        Fetch one page of entities from /v1/entities.
+
+        Args:
+            params (dict): Query parameters for /v1/entities.
+
+        Returns:
+            list: Entities in the page.
+        """
+        return self._request("GET", f"{self.orion_url}/v1/entities", params=params)
+
+    def _query_entities(self, body: dict, params: dict) -> list:
+        """
+        Fetch one page of entities from /v1/entityOperations/query.
+
+        Args:
+            body (dict): NGSI-LD Query body.
+            params (dict): Pagination parameters (limit, offset).
+
+        Returns:
+            list: Entities in the page.
+        """
+        headers = {"Link": NGSI_LD_CONTEXT_LINK}
+        return self._request("POST", f"{self.orion_url}/v1/entityOperations/query", params=params, json=body, headers=headers)
+
+    @staticmethod
+    def _attribute_value(entity: dict, attribute: str) -> str:
+        """
+        Read the value of an NGSI-LD Property, unwrapping typed values like DateTime.
+
+        Args:
+            entity (dict): Entity as returned by the broker.
+            attribute (str): Attribute name.
+
+        Returns:
+            str: Attribute value, or an empty string if it is missing.
+        """
+        value = entity.get(attribute, {})
+        if isinstance(value, dict):
+            value = value.get("value", "")
+        if isinstance(value, dict):
+            value = value.get("@value", "")
+        return value or ""
+
+    def iter_entity_pages(self, entity_type: str, path_prefix: str = "galeria", batch_size: int = 1000,
+                          server_filter: bool = True, use_query_endpoint: bool = False, since: str = None,
+                          watermark_attr: str = None) -> Iterator[List[dict]]:
+        """
+        Yield pages of entities whose 'path' starts with path_prefix, in the broker's offset order.
+
+        Pages are requested in windows of max_workers consecutive offsets fetched concurrently;
+        paging stops at the first empty page.
+
+        With server_filter the prefix (and the since watermark) is sent to the broker as an
+        NGSI-LD q expression and only the needed attributes are requested. If the broker rejects
+        the query, paging restarts without them and the filters are only applied locally.
+
+        Args:
+            entity_type (str): Type of entities to fetch.
+            path_prefix (str): Prefix for filtering 'path' values.
+            batch_size (int): Maximum number of entities per batch.
+            server_filter (bool): Push the filter and the attribute projection to the broker.
+            use_query_endpoint (bool): Use POST /v1/entityOperations/query instead of GET /v1/entities.
+            since (str): Only return entities whose watermark_attr is later than this ISO timestamp.
+            watermark_attr (str): Timestamp attribute to project and compare against since.
+
+        Yields:
+            List[dict]: Filtered entities of each page.
+
+        Raises:
+            requests.exceptions.RequestException: If a page cannot be fetched.
+        """
+        offset = 0
+        query = f'path~="^{re.escape(path_prefix)}"'
+        attrs = ["path"]
+        if watermark_attr:
+            attrs.append(watermark_attr)
+            if since:
+                query += f";{watermark_attr}>{since}"
+
+        def fetch_page(page_offset, use_server_filter):
+            pagination = {"limit": batch_size, "offset": page_offset}
+            if use_query_endpoint:
+                body = {"type": "Query", "entities": [{"type": entity_type}]}
+                if use_server_filter:
+                    body.update({"q": query, "attrs": attrs})
+                return self._query_entities(body, pagination)
+
+            params = {"type": entity_type, **pagination}
+            if use_server_filter:
+                params.update({"q": query, "attrs": ",".join(attrs)})
+            return self._get_entities(params)
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while True:
+                offsets = [offset + i * batch_size for i in range(self.max_workers)]
+                try:
+                    # map returns the pages in offset order
+                    pages = list(executor.map(fetch_page, offsets, [server_filter] * len(offsets)))
+                except requests.exceptions.RequestException as e:
+                    rejected = isinstance(e, requests.exceptions.HTTPError) and e.response is not None \
+                        and e.response.status_code in (400, 422)
+                    if server_filter and rejected and offset == 0:
+                        print("⚠️ Broker rejected the server-side filter, filtering paths locally...")
+                        server_filter = False
+                        continue
+                    print(f"Error fetching entities: {e}")
+                    raise
+
+                finished = False
+                for entities in pages:
+                    if not entities:
+                        finished = True  # No more entities available
+                        break
+
+                    yield [
+                        entity for entity in entities
+                        if self._attribute_value(entity, "path").startswith(path_prefix)
+                        and (not since or not watermark_attr or self._attribute_value(entity, watermark_attr) > since)
+                    ]
+                    offset += batch_size
+                print(f"Processed {offset} entities...")
+
+                if finished:
+                    break
+
+    def fetch_and_filter_entities(self, entity_type: str, path_prefix: str = "galeria", batch_size: int = 1000,
+                                  server_filter: bool = True, use_query_endpoint: bool = False) -> List[str]:
         """
         Fetch and filter entities based on a prefix for the 'path' field.
 
+        See iter_entity_pages for how pages are fetched and filtered. If a page fails, the paths
+        collected so far are returned.
+
         Args:
             entity_type (str): Type of entities to fetch.
             path_prefix (str): Prefix for filtering 'path' values.
             batch_size (int): Maximum number of entities per batch.
+            server_filter (bool): Push the filter and the attribute projection to the broker.
+            use_query_endpoint (bool): Use POST /v1/entityOperations/query instead of GET /v1/entities.
 
         Returns:
             List[str]: List of filtered paths.
         """
-        offset = 0
         filtered_paths = []
+        try:
+            for paths in self.iter_filtered_path_pages(entity_type, path_prefix, batch_size, server_filter, use_query_endpoint):
+                filtered_paths.extend(paths)
+        except requests.exceptions.RequestException:
+            pass
 
-        while True:
-            headers = {
-                "Content-Type": "application/json",
-                "Accept": "application/json",
-                "Authorization": f"Bearer {self.get_token()}"
-            }
+        return filtered_paths
 
-            params = {"type": entity_type, "limit": batch_size, "offset": offset}
-            try:
-                response = requests.get(f"{self.orion_url}/v1/entities", params=params, headers=headers)
-                if response.status_code == 401:
-                    print("⚠️ Token expired, refreshing token and retrying...")
-                    self.obtain_token()
-                    headers["Authorization"] = f"Bearer {self.token}"
-                    response = requests.get(f"{self.orion_url}/v1/entities", params=params, headers=headers)
+    def iter_filtered_path_pages(self, entity_type: str, path_prefix: str = "galeria", batch_size: int = 1000,
+                                 server_filter: bool = True, use_query_endpoint: bool = False) -> Iterator[List[str]]:
+        """
+        Yield the filtered paths page by page, see iter_entity_pages.
 
-                response.raise_for_status()
-                entities = response.json()
+        Args:
+            entity_type (str): Type of entities to fetch.
+            path_prefix (str): Prefix for filtering 'path' values.
+            batch_size (int): Maximum number of entities per batch.
+            server_filter (bool): Push the filter and the attribute projection to the broker.
+            use_query_endpoint (bool): Use POST /v1/entityOperations/query instead of GET /v1/entities.
 
-                if not entities:
-                    break  # No more entities available
+        Yields:
+            List[str]: Paths in each page.
+        """
+        for entities in self.iter_entity_pages(entity_type, path_prefix, batch_size, server_filter, use_query_endpoint):
+            yield [self._attribute_value(entity, "path") for entity in entities]
+
+    @staticmethod
+    def load_watermark(state_file: str = "orion_watermark.json") -> Optional[str]:
+        """
+        Load the last synced timestamp.
 
+        Args:
+            state_file (str): File where the watermark is persisted.
+
+        Returns:
+            Optional[str]: ISO timestamp, or None if no sync has completed yet.
+        """
+        try:
+            with open(state_file, "r") as json_file:
+                return json.load(json_file).get("watermark")
+        except (IOError, ValueError):
+            return None
+
+    @staticmethod
+    def save_watermark(watermark: str, state_file: str = "orion_watermark.json") -> None:
+        """
+        Persist the last synced timestamp, replacing the state file atomically.
+
+        Args:
+            watermark (str): ISO timestamp.
+            state_file (str): File where the watermark is persisted.
+        """
+        temp_file = state_file + ".tmp"
+        with open(temp_file, "w") as json_file:
+            json.dump({"watermark": watermark, "updated_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())}, json_file)
+        os.replace(temp_file, state_file)
+
+    @staticmethod
+    def lookback_timestamp(since: str, hours: float) -> str:
+        """
+        Move an ISO timestamp back by `hours`, keeping its "Z" suffix so it still compares as a string.
+
+        Args:
+            since (str): ISO timestamp, e.g. the persisted watermark.
+            hours (float): Hours to go back.
+
+        Returns:
+            str: The earlier ISO timestamp.
+        """
+        earlier = datetime.fromisoformat(since.replace("Z", "+00:00")) - timedelta(hours=hours)
+        earlier = earlier.isoformat()
+        return earlier.replace("+00:00", "Z") if since.endswith("Z") else earlier
+
+    def iter_new_path_pages(self, entity_type: str, path_prefix: str = "galeria", batch_size: int = 1000,
+                            state_file: str = "orion_watermark.json", watermark_attr: str = "dateObserved",
+                            server_filter: bool = True, lookback_hours: float = 24) -> Iterator[List[str]]:
+        """
+        Yield, page by page, the paths of entities newer than the persisted watermark.
+
+        The watermark is a recording time, so an entity registered late can be older than it;
+        entities observed up to lookback_hours before the watermark are fetched again to catch
+        those (downloads skip the videos already in video_recorded).
+
+        The watermark is the latest watermark_attr seen. Once every page has been consumed without
+        errors it is saved as pending, in "<state_file>.pending", and download.py only commits it
+        to state_file once every path was downloaded (see download.commit_orion_watermark), so the
+        paths of a failed sync or of failed downloads are yielded again next time.
+
+        Args:
+            entity_type (str): Type of entities to fetch.
+            path_prefix (str): Prefix for filtering 'path' values.
+            batch_size (int): Maximum number of entities per batch.
+            state_file (str): File where the watermark is persisted.
+            watermark_attr (str): Timestamp attribute used as watermark.
+            server_filter (bool): Push the filters and the attribute projection to the broker.
+            lookback_hours (float): Hours before the watermark that are synced again (0 = none).
+
+        Yields:
+            List[str]: Paths of the new entities in each page.
+
+        Raises:
+            requests.exceptions.RequestException: If a page cannot be fetched.
+        """
+        since = self.load_watermark(state_file)
+        query_since = self.lookback_timestamp(since, lookback_hours) if since and lookback_hours > 0 else since
+        print(f"Syncing entities with {watermark_attr} after {query_since or 'the beginning'}...")
+
+        watermark = since
+        try:
+            for entities in self.iter_entity_pages(entity_type, path_prefix, batch_size, server_filter,
+                                                   since=query_since, watermark_attr=watermark_attr):
                 for entity in entities:
-                    path_value = entity.get("path", {}).get("value", "")
-                    if path_value.startswith(path_prefix):
-                        filtered_paths.append(path_value)
+                    observed = self._attribute_value(entity, watermark_attr)
+                    if observed and (watermark is None or observed > watermark):
+                        watermark = observed
+                yield [self._attribute_value(entity, "path") for entity in entities]
+        except requests.exceptions.RequestException:
+            print("Sync incomplete, the watermark was not advanced.")
+            raise
 
-                offset += batch_size
-                print(f"Processed {offset} entities...")
+        if watermark and watermark != since:
+            self.save_watermark(watermark, state_file + ".pending")
+            print(f"Watermark {watermark} pending until the downloads complete.")
 
-            except requests.exceptions.RequestException as e:
-                print(f"Error fetching entities: {e}")
-                break
+    def sync_new_paths(self, entity_type: str, path_prefix: str = "galeria", batch_size: int = 1000,
+                       state_file: str = "orion_watermark.json", watermark_attr: str = "dateObserved",
+                       server_filter: bool = True, lookback_hours: float = 24) -> List[str]:
+        """
+        Fetch only the paths of entities newer than the persisted watermark.
 
-        return filtered_paths
+        See iter_new_path_pages. If a page fails, the paths collected so far are returned.
+
+        Args:
+            entity_type (str): Type of entities to fetch.
+            path_prefix (str): Prefix for filtering 'path' values.
+            batch_size (int): Maximum number of entities per batch.
+            state_file (str): File where the watermark is persisted.
+            watermark_attr (str): Timestamp attribute used as watermark.
+            server_filter (bool): Push the filters and the attribute projection to the broker.
+            lookback_hours (float): Hours before the watermark that are synced again (0 = none).
+
+        Returns:
+            List[str]: Paths of the new entities.
+        """
+        new_paths = []
+        try:
+            for paths in self.iter_new_path_pages(entity_type, path_prefix, batch_size, state_file, watermark_attr, server_filter,
+                                                  lookback_hours):
+                new_paths.extend(paths)
+        except requests.exceptions.RequestException:
+            pass
+        return new_paths
+
+    def save_paths_ndjson(self, path_pages: Iterable[List[str]], output_file: str = "filtered_paths.ndjson") -> int:
+        """
+        Write paths as newline-delimited JSON, appending each page as soon as it arrives.
+
+        Each run writes a token to "<output_file>.start" once the file has been truncated, and
+        the same token to "<output_file>.done" at the end, also after an error, so a consumer
+        following the file (see download.read_paths_ndjson) waits for a new run instead of
+        reading the previous one, and knows when no more paths will come.
+
+        Args:
+            path_pages (Iterable[List[str]]): Pages of paths, e.g. from iter_new_path_pages.
+            output_file (str): Output file name.
+
+        Returns:
+            int: Number of paths written.
+        """
+        start_marker = output_file + ".start"
+        done_marker = output_file + ".done"
+        if os.path.exists(done_marker):
+            os.remove(done_marker)
+        run_token = uuid.uuid4().hex
+
+        written = 0
+        try:
+            with open(output_file, "w") as ndjson_file:
+                self._write_marker(start_marker, run_token)
+                for paths in path_pages:
+                    ndjson_file.writelines(json.dumps(path) + "\n" for path in paths)
+                    ndjson_file.flush()
+                    written += len(paths)
+            print(f"{written} paths streamed to '{output_file}'.")
+        except (IOError, requests.exceptions.RequestException) as e:
+            print(f"Error streaming paths to file: {e}")
+        finally:
+            self._write_marker(done_marker, run_token)
+        return written
+
+    @staticmethod
+    def _write_marker(marker_file: str, run_token: str) -> None:
+        """Write a run token to a marker file, replacing it atomically."""
+        temp_file = marker_file + ".tmp"
+        with open(temp_file, "w") as token_file:
+            token_file.write(run_token)
+        os.replace(temp_file, marker_file)
 
     def save_filtered_paths(self, paths: List[str], output_file: str = "filtered_paths.json") -> None:
         """
@@ -135,13 +491,33 @@ if __name__ == "__main__":
         print("Client ID and Client Secret must be provided in the .env file.")
         exit(1)
 
-    manager = OrionManager(client_id, client_secret, keycloak_url, orion_url)
+    manager = OrionManager(client_id, client_secret, keycloak_url, orion_url,
+                           max_workers=int(os.getenv("ORION_WORKERS", "4")))
 
     # Fetch and filter paths
     entity_type = "videoRecorded"
-    filtered_paths = manager.fetch_and_filter_entities(entity_type=entity_type, path_prefix="galeria")
+    server_filter = os.getenv("ORION_SERVER_FILTER", "1") == "1"
+    incremental = os.getenv("ORION_INCREMENTAL", "0") == "1"
+    # Horas antes del watermark que se vuelven a sincronizar, para entidades registradas tarde
+    lookback_hours = float(os.getenv("ORION_LOOKBACK_HOURS", "24"))
+
+    if os.getenv("ORION_OUTPUT_FORMAT", "json") == "ndjson":
+        # Stream each page to filtered_paths.ndjson so download.py can start right away
+        if incremental:
+            path_pages = manager.iter_new_path_pages(entity_type=entity_type, path_prefix="galeria", server_filter=server_filter,
+                                                     lookback_hours=lookback_hours)
+        else:
+            path_pages = manager.iter_filtered_path_pages(entity_type=entity_type, path_prefix="galeria", server_filter=server_filter)
+        manager.save_paths_ndjson(path_pages)
+    else:
+        if incremental:
+            # Only the entities observed after the last successful sync
+            filtered_paths = manager.sync_new_paths(entity_type=entity_type, path_prefix="galeria", server_filter=server_filter,
+                                                    lookback_hours=lookback_hours)
+        else:
+            filtered_paths = manager.fetch_and_filter_entities(entity_type=entity_type, path_prefix="galeria", server_filter=server_filter)
 
-    print(f"Total filtered paths: {len(filtered_paths)}")
+        print(f"Total filtered paths: {len(filtered_paths)}")
 
-    # Save the paths to a file
-    manager.save_filtered_paths(filtered_paths)
\ No newline at end of file
+        # Save the paths to a file
+        manager.save_filtered_paths(filtered_paths)
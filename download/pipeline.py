@@ -0,0 +1,243 @@
+"""
+Pipelined download and processing.
+
+Downloads run in a background thread while the processing pool drains the video_processing
+queue, so inference starts with the first downloaded videos instead of after the whole backlog.
+A DiskBudget on videosGaleria/ (PIPELINE_BUDGET_GB and/or PIPELINE_BUDGET_FILES) pauses the
+downloads while the buffer is full; they resume as processed videos are deleted.
+
+    python pipeline.py
+
+Paths are discovered like download.py does (DISCOVERY_SOURCE, DOWNLOAD_PATHS_FILE, ...).
+"""
+import os
+import time
+import logging
+import threading
+import multiprocessing
+from dotenv import load_dotenv
+from download import AzureVideos, discover_paths, commit_discovery
+import processingQueue as queue
+from processVideos import (Session, RunStats, init_db, init_worker, drain_queue, delete_invalid_videos, pool_settings,
+                           claim_size, model_path, videos_galeria_path, detector_backend, detector_precision,
+                           detector_imgsz)
+from detectorBackends import export_model
+
+_LOGGER = logging.getLogger('video_pipeline')
+
+# Cargar variables de entorno antes de leer la configuracion
+load_dotenv('.env')
+
+# Limite del buffer de videos en disco (vacio = sin limite) y segundos entre revisiones
+budget_gb = os.getenv('PIPELINE_BUDGET_GB')
+budget_files = os.getenv('PIPELINE_BUDGET_FILES')
+poll_interval = float(os.getenv('PIPELINE_POLL_SECONDS', '2'))
+
+
+class DiskBudget:
+    """
+    Byte and file-count budget of a download directory, shared by the download threads.
+
+    Usage is the completed videos found in the directory (so space freed by the processing
+    workers' delete_video_file is seen without any messages between processes) plus a
+    reservation for each download in flight, of its expected size or the mean size seen so far.
+    """
+
+    def __init__(self, directory, max_bytes=None, max_files=None, poll_interval=1.0, idle=None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        self.poll_interval = poll_interval
+        # Called while waiting; True when nothing is left to free space (e.g. only failed videos on disk)
+        self.idle = idle
+        self.peak_bytes = 0
+        self.peak_files = 0
+        self.waited_seconds = 0.0
+        self._reserved = {}
+        self._mean_size = None
+        self._lock = threading.Lock()
+
+    def usage(self):
+        """(bytes, files) of the completed videos in the directory."""
+        used_bytes, used_files = 0, 0
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith(('.part', '.part.etag')):
+                    continue
+                try:
+                    used_bytes += os.path.getsize(os.path.join(root, name))
+                except OSError:
+                    continue
+                used_files += 1
+        return used_bytes, used_files
+
+    def _try_reserve(self, path, expected_size):
+        used_bytes, used_files = self.usage()
+        with self._lock:
+            if used_files:
+                self._mean_size = used_bytes // used_files
+            reserved_bytes = sum(self._reserved.values())
+            reserved_files = len(self._reserved)
+            if expected_size is None:
+                # Sin tamano conocido todavia, una sola descarga a la vez hasta ver el primer video
+                if self._mean_size is None and reserved_files:
+                    return False
+                expected_size = self._mean_size or 0
+            empty = used_files + reserved_files == 0
+            fits = ((self.max_bytes is None or used_bytes + reserved_bytes + expected_size <= self.max_bytes)
+                    and (self.max_files is None or used_files + reserved_files + 1 <= self.max_files))
+            if fits or empty:
+                # A video larger than the whole budget still goes through when the buffer is empty
+                self._reserved[path] = expected_size
+                self.peak_bytes = max(self.peak_bytes, used_bytes + reserved_bytes + expected_size)
+                self.peak_files = max(self.peak_files, used_files + reserved_files + 1)
+                return True
+        return False
+
+    def acquire(self, path, expected_size=None, block=True, on_wait=None):
+        """
+        Reserve space for a download; waits while over budget unless block is False.
+
+        on_wait is called on every round of the wait, before the idle check, e.g. to record the
+        downloads that finished meanwhile so they can be processed.
+        """
+        if self._try_reserve(path, expected_size):
+            return True
+        if not block:
+            return False
+        start = time.perf_counter()
+        try:
+            while not self._try_reserve(path, expected_size):
+                if on_wait:
+                    on_wait()
+                if self.idle and self.idle():
+                    _LOGGER.warning(f"Over the disk budget with nothing left to process, downloading {path} anyway")
+                    with self._lock:
+                        self._reserved[path] = expected_size or 0
+                    break
+                time.sleep(self.poll_interval)
+        finally:
+            self.waited_seconds += time.perf_counter() - start
+        return True
+
+    def release(self, path):
+        """Drop the reservation of a finished download; the file itself now counts as usage."""
+        with self._lock:
+            self._reserved.pop(path, None)
+
+
+def queue_idle():
+    """
+    Whether no video can be claimed or is in processing, after queueing the recorded ones.
+
+    Videos waiting out a retry backoff do not count: they would not free space before it ends.
+    """
+    session = Session()
+    try:
+        queue.enqueue_new_videos(session)
+        return queue.count_claimable(session) == 0 and queue.count_videos(session, queue.PROCESSING) == 0
+    finally:
+        session.close()
+
+
+def run_pipeline(azure_client, paths, budget, num_processes, num_threads, expected_sizes=None,
+                 index_chunk_size=None):
+    """
+    Download `paths` into the budgeted directory while the pool processes what has arrived.
+
+    Each pool worker runs drain_queue; a worker that finds the queue empty is started again
+    once new downloads are queued. Returns the download statistics.
+    """
+    download_stats = {}
+    download_done = threading.Event()
+
+    def download():
+        try:
+            download_stats.update(azure_client.download_videos_by_paths(
+                paths, batch_size=4, index_chunk_size=index_chunk_size, expected_sizes=expected_sizes,
+                disk_budget=budget))
+        except Exception as e:
+            _LOGGER.error(f"Download failed: {e}")
+        finally:
+            azure_client.status_writer.flush()
+            download_done.set()
+
+    run_stats = RunStats()
+    session = Session()
+    downloader = threading.Thread(target=download, name='pipeline-download', daemon=True)
+    try:
+        with multiprocessing.Pool(processes=num_processes, initializer=init_worker, initargs=(num_threads,)) as pool:
+            # Los procesos ya estan creados: el hilo de descarga no se copia en ellos
+            downloader.start()
+            running = []
+            while True:
+                # Leer la bandera antes de encolar: lo descargado hasta ahi ya esta en video_recorded
+                downloads_finished = download_done.is_set()
+                queue.enqueue_new_videos(session)
+                delete_invalid_videos(session)
+                # Los videos liberados tras un error esperan su backoff y quedan para otra corrida
+                pending = queue.count_claimable(session)
+
+                for result in [result for result in running if result.ready()]:
+                    running.remove(result)
+                    run_stats.add(result.get())
+
+                wanted = min(num_processes, -(-pending // claim_size))
+                for _ in range(wanted - len(running)):
+                    running.append(pool.apply_async(drain_queue, (claim_size,)))
+
+                if downloads_finished and not pending and not running:
+                    break
+                time.sleep(poll_interval)
+    finally:
+        session.close()
+    downloader.join()
+
+    run_stats.report()
+    _LOGGER.info(f"Pipeline: {run_stats.videos} videos processed; buffer peak {budget.peak_bytes / 1024 ** 2:.1f} MB "
+                 f"in {budget.peak_files} files, downloads paused {budget.waited_seconds:.1f}s")
+    return download_stats
+
+
+def main():
+    num_processes, num_threads = pool_settings(os.getenv('PROCESS_WORKERS'), os.getenv('PROCESS_THREADS_PER_WORKER'))
+    init_db()
+    session = Session()
+    try:
+        recovered = queue.recover_stale_claims(session)
+        _LOGGER.info(f"{recovered} stale claims recovered.")
+    finally:
+        session.close()
+    if detector_backend != 'pytorch':
+        # Exportar una sola vez antes de que los procesos carguen el modelo
+        export_model(model_path, detector_backend, detector_precision, detector_imgsz)
+
+    # Sin limite configurado el buffer guarda cuatro reclamaciones por proceso
+    max_files = int(budget_files) if budget_files else (None if budget_gb else 4 * num_processes * claim_size)
+    budget = DiskBudget(videos_galeria_path,
+                        max_bytes=int(float(budget_gb) * 1024 ** 3) if budget_gb else None,
+                        max_files=max_files, poll_interval=poll_interval, idle=queue_idle)
+    os.makedirs(videos_galeria_path, exist_ok=True)
+
+    azure_client = AzureVideos(
+        output_dir=videos_galeria_path,
+        sas_token=os.getenv("AZURE_STORAGE_SAS_TOKEN"),
+        account_url=os.getenv("AZURE_STORAGE_ACCOUNT_URL"),
+        max_workers=int(os.getenv("DOWNLOAD_WORKERS", "8")),
+        chunk_concurrency=int(os.getenv("DOWNLOAD_CHUNK_CONCURRENCY", "1")),
+        probe_metadata=os.getenv("DOWNLOAD_PROBE", "1") == "1"
+    )
+    try:
+        paths, expected_sizes, listing_watermark = discover_paths(azure_client)
+        _LOGGER.info(f"Pipelining with {num_processes} workers x {num_threads} threads, "
+                     f"buffer of {budget_gb or '-'} GB / {max_files or '-'} files")
+        stats = run_pipeline(azure_client, paths, budget, num_processes, num_threads, expected_sizes,
+                             int(os.getenv("DOWNLOAD_INDEX_CHUNK_SIZE", "0")) or None)
+        commit_discovery(stats, listing_watermark)
+    finally:
+        azure_client.close()
+    _LOGGER.info("✅ Pipeline completed.")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,23 @@
 import os
+import time
 import cv2
-import numpy as np
 import logging
 import multiprocessing
 from collections import defaultdict, Counter
-from ultralytics import YOLO
-from sqlalchemy import create_engine, Column, String, Float, text
+import torch
+from sqlalchemy import (create_engine, Column, String, Float, Integer, BigInteger, Boolean, DateTime, Text, Index,
+                        UniqueConstraint, func, inspect)
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.orm import declarative_base, sessionmaker
-from sqlalchemy.exc import SQLAlchemyError, IntegrityError
+from sqlalchemy.exc import SQLAlchemyError
 from dotenv import load_dotenv
+from tracking import VideoProcessingError, VideoTrackState, create_tracker, empty_detections, iter_frames
+from batchInference import BatchedInferenceEngine
+import processingQueue as queue
+from cameraConfig import camera_for_video
+from motionGate import MotionGate, motion_gate_enabled, motion_stats, take_motion_stats, video_has_motion
+from profiling import profiler, write_run_report
+from detectorBackends import load_detector, export_model, detector_backend, detector_precision, detector_imgsz
 
 # Configuracion de logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -19,6 +28,27 @@ load_dotenv('.env')
 
 # Paths
 videos_galeria_path = 'videosGaleria'
+model_path = 'best.pt'
+tracker_path = 'botsort.yaml'
+# BoT-SORT ajustado para inferencia a baja frecuencia (mas movimiento entre cuadros analizados)
+strided_tracker_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'botsort_strided.yaml')
+
+# Frecuencia de analisis (Hz): solo se detecta y rastrea en los cuadros que alimentan el estado de los tracks
+analysis_hz = float(os.getenv('ANALYSIS_HZ', '5'))
+# Cuadros por pasada del modelo en el motor por lotes entre videos (0 = un video a la vez)
+inference_batch_size = int(os.getenv('INFERENCE_BATCH_SIZE', '0'))
+
+# Modelo YOLO, cargado una vez por proceso con el backend de DETECTOR_BACKEND (ver init_worker)
+_MODEL = None
+
+# Procesos del pool y hilos de torch/OpenCV por proceso (vacio = derivado de los CPUs disponibles)
+process_workers = os.getenv('PROCESS_WORKERS')
+threads_per_worker = os.getenv('PROCESS_THREADS_PER_WORKER')
+# Videos reclamados por vez de la cola video_processing (vacio = INFERENCE_BATCH_SIZE o 1)
+claim_size = int(os.getenv('PROCESS_CLAIM_SIZE') or max(1, inference_batch_size))
+# Insercion de tracks: se confirma cada TRACK_BATCH_VIDEOS videos o TRACK_BATCH_ROWS filas
+track_batch_videos = int(os.getenv('TRACK_BATCH_VIDEOS', '20'))
+track_batch_rows = int(os.getenv('TRACK_BATCH_ROWS', '5000'))
 
 # Configuracion de base de datos
 Base = declarative_base()
@@ -34,20 +64,58 @@ Session = sessionmaker(bind=engine)
 # Modelos de datos
 class Track(Base):
     __tablename__ = 'tracks'
-    track_id = Column(String, primary_key=True)
+    id = Column(Integer, primary_key=True, autoincrement=True)
     video_id = Column(String, nullable=False)
+    track_id = Column(String)
     duration = Column(Float)
     direction = Column(String)
+    __table_args__ = (UniqueConstraint('video_id', 'track_id', name='tracks_video_id_track_id_key'),)
 
-Base.metadata.create_all(engine)
+class VideoProcessing(Base):
+    __tablename__ = 'video_processing'
+    video_id = Column(String, primary_key=True)
+    status = Column(String, nullable=False, server_default=queue.PENDING)
+    attempts = Column(Integer, nullable=False, server_default='0')
+    claimed_by = Column(String)
+    claimed_at = Column(DateTime)
+    last_error = Column(Text)
+    updated_at = Column(DateTime, nullable=False, server_default=func.now())
+    __table_args__ = (Index('video_processing_status_idx', 'status', 'updated_at'),)
 
-# Utilidades
+class VideoMetadata(Base):
+    __tablename__ = 'video_metadata'
+    video_id = Column(String, primary_key=True)
+    fps = Column(Float)
+    frame_count = Column(Integer)
+    duration = Column(Float)
+    width = Column(Integer)
+    height = Column(Integer)
+    codec = Column(String)
+    size_bytes = Column(BigInteger)
+    valid = Column(Boolean, nullable=False)
+    probed_at = Column(DateTime, nullable=False, server_default=func.now())
 
-def calculate_angle(vector):
-    return np.degrees(np.arctan2(vector[1], vector[0]))
+def init_db():
+    Base.metadata.create_all(engine)
+    ensure_tracks_unique_key()
 
-def classify_direction(angle, threshold):
-    return "forward" if angle <= threshold else "backward"
+def ensure_tracks_unique_key():
+    """
+    Check that tracks has the (video_id, track_id) key that TrackWriter's ON CONFLICT needs.
+
+    create_all does not alter a tracks table created before the key existed; that database
+    needs the one-off migration at the end of create_tables.sql, which removes duplicate tracks
+    first. Raises RuntimeError instead of inserting tracks without the key.
+    """
+    tracks = inspect(engine)
+    key = ['video_id', 'track_id']
+    if any(constraint['column_names'] == key for constraint in tracks.get_unique_constraints('tracks')) or \
+            any(index['unique'] and index['column_names'] == key for index in tracks.get_indexes('tracks')):
+        return
+    raise RuntimeError("tracks has no unique (video_id, track_id) key; "
+                       "run the migration at the end of create_tables.sql before processing")
+
+# Utilidades
 
 def delete_video_file(video_path):
     try:
@@ -58,116 +126,440 @@ def delete_video_file(video_path):
     except OSError as e:
         _LOGGER.error(f"Error deleting video file {video_path}: {e}")
 
-def process_video(video_path, video_id):
-    _LOGGER.info(f"Processing video: {video_path} (ID: {video_id})")
+def delete_invalid_videos(session):
+    """Delete the files of videos set to invalid when queued; they would otherwise stay on disk."""
+    for path in queue.invalid_video_paths(session):
+        video_path = os.path.join(videos_galeria_path, path)
+        if os.path.exists(video_path):
+            delete_video_file(video_path)
+
+def available_cpus():
     try:
-        model = YOLO('best.pt')
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+def pool_settings(workers=None, threads=None):
+    """
+    Return (workers, threads_per_worker) so that workers * threads does not exceed the CPUs.
+
+    Unset values are derived from the CPUs available to this process: one thread per worker
+    by default, or as many threads as fit when only the worker count is given.
+    """
+    cpus = available_cpus()
+    workers = int(workers) if workers else None
+    threads = int(threads) if threads else None
+    if workers is None:
+        threads = threads or 1
+        workers = max(1, cpus // threads)
+    elif threads is None:
+        threads = max(1, cpus // workers)
+    return workers, threads
+
+def limit_threads(threads):
+    """Cap the torch and OpenCV thread pools of this process."""
+    if threads:
+        torch.set_num_threads(threads)
+        cv2.setNumThreads(threads)
+
+def init_worker(threads=None):
+    """Pool initializer: limit the torch/OpenCV thread pools and load the YOLO model once per worker process."""
+    global _MODEL
+    # Las conexiones heredadas del proceso padre no se reutilizan: cada proceso abre las suyas
+    engine.dispose(close=False)
+    limit_threads(threads)
+    start = time.perf_counter()
+    try:
+        _MODEL = load_detector(model_path)
     except Exception as e:
+        _MODEL = None
         _LOGGER.error(f"Failed to load YOLO model: {e}")
-        return []
+        return
+    _LOGGER.info(f"Loaded YOLO model '{model_path}' ({detector_backend}, {detector_precision}) in {time.perf_counter() - start:.2f}s (pid {os.getpid()})")
+
+def get_model():
+    if _MODEL is None:
+        init_worker()
+    return _MODEL
+
+def analysis_stride(fps, hz):
+    """Frame stride that samples a video of `fps` frames per second at about `hz` analyses per second."""
+    return max(1, int(fps // hz))
+
+def process_video(video_path, video_id, full_rate=False, hz=None, fps=None):
+    """
+    Track people in a video and summarize each track.
+
+    fps is the frame rate from video_metadata when known; otherwise it is read from the file.
+    Raises VideoProcessingError when the video cannot be analysed, so a failure is not taken for
+    a video without detections.
+
+    By default detection and tracking only run on one frame every analysis_stride frames
+    (ANALYSIS_HZ, 5 Hz), using the strided tracker configuration. With full_rate every frame
+    goes through the tracker and positions are still sampled at the analysis rate. With the
+    motion gate, frames without motion skip the detector and the tracker gets no detections.
+    """
+    _LOGGER.info(f"Processing video: {video_path} (ID: {video_id})")
+    model = get_model()
+    if model is None:
+        raise VideoProcessingError(f"YOLO model '{model_path}' is not loaded")
 
     cap = cv2.VideoCapture(video_path)
     if not cap.isOpened():
-        _LOGGER.error(f"Could not open video: {video_path}")
-        return []
+        raise VideoProcessingError(f"Could not open video: {video_path}")
 
-    fps = int(cap.get(cv2.CAP_PROP_FPS))
+    fps = int(fps or cap.get(cv2.CAP_PROP_FPS))
     if fps <= 0:
-        _LOGGER.error(f"Invalid FPS ({fps}) for video: {video_path}")
         cap.release()
-        return []
+        raise VideoProcessingError(f"Invalid FPS ({fps}) for video: {video_path}")
+
+    sample_stride = analysis_stride(fps, hz or analysis_hz)
+    if full_rate:
+        vid_stride, tracker_cfg = 1, tracker_path
+    else:
+        vid_stride, tracker_cfg = sample_stride, strided_tracker_path
 
+    # Cada cuadro se recorta al ROI de la camara antes de la deteccion; las cajas vuelven al cuadro original
+    camera = camera_for_video(video_path)
+    tracker = create_tracker(tracker_cfg)
+    state = VideoTrackState(video_path)
+    gate = MotionGate() if motion_gate_enabled else None
+
+    profiler.begin_video(video_id)
+    frames = iter_frames(cap, vid_stride)
+    frame_count = 0
     try:
-        results = model.track(video_path, classes=0, show=False, conf=0.55, iou=0.6, tracker='botsort.yaml', stream=True)
+        while True:
+            with profiler.time('decode', video_id):
+                item = next(frames, None)
+                if item is not None:
+                    frame_idx, frame = item
+                    cropped, offset = camera.crop(frame)
+            if item is None:
+                break
+            frame_count += 1
+
+            with profiler.time('motion', video_id):
+                moving = gate is None or gate.is_moving(cropped)
+            if moving:
+                with profiler.time('inference', video_id):
+                    result = model.predict(cropped, classes=0, conf=0.55, iou=0.6, imgsz=camera.imgsz, verbose=False)[0]
+                    detections = result.boxes.cpu().numpy()
+                motion_stats['frames_analyzed'] += 1
+            else:
+                detections = empty_detections(cropped)
+                motion_stats['frames_skipped'] += 1
+            with profiler.time('tracking', video_id):
+                tracks = tracker.update(detections, cropped)
+
+            if frame_idx % sample_stride == 0 and len(tracks):
+                with profiler.time('postprocess', video_id):
+                    timestamp = (frame_idx / fps)
+                    state.update(timestamp, tracks[:, 4].astype(int).tolist(), camera.to_frame(tracks[:, :4], offset))
+
+        with profiler.time('postprocess', video_id):
+            return state.to_rows(video_id)
     except Exception as e:
-        _LOGGER.error(f"YOLO tracking failed for {video_path}: {e}")
+        raise VideoProcessingError(f"YOLO tracking failed for {video_path}: {e}") from e
+    finally:
         cap.release()
-        return []
-
-    previous_positions = {}
-    track_history = defaultdict(list)
-
-    for frame_idx, result in enumerate(results):
-        timestamp = (frame_idx / fps) 
-
-        if frame_idx % (fps // 5) == 0 and result.boxes.is_track:
-            ids = result.boxes.id.int().cpu().tolist()
-            for j, track_id in enumerate(ids):
-                xyxy = [int(x) for x in result.boxes.xyxy[j]]
-                cx = (xyxy[0] + xyxy[2]) // 2
-                cy = (xyxy[1] + xyxy[3]) // 2
-                position = (cx, cy)
-                unique_id = f"{track_id}_{os.path.basename(video_path).split('.')[0]}"
-                angle = None
-
-                if unique_id in previous_positions:
-                    dx = position[0] - previous_positions[unique_id][0]
-                    dy = position[1] - previous_positions[unique_id][1]
-                    angle = calculate_angle((dx, dy))
-
-                previous_positions[unique_id] = position
-                direction = classify_direction(angle, 0) if angle is not None else 'unknown'
-                track_history[unique_id].append((timestamp, direction))
-
-    cap.release()
-
-    video_tracking_data = []
-    for track_id, entries in track_history.items():
-        last_time = max(t for t, _ in entries)
-        common_dir = Counter(d for _, d in entries).most_common(1)[0][0]
-        video_tracking_data.append({
-            'track_id': track_id,
-            'video_id': video_id,
-            'duration': last_time,
-            'direction': common_dir
-        })
-
-    return video_tracking_data
-
-def split_list(lst, n):
-    k, m = divmod(len(lst), n)
-    return (lst[i * k + min(i, m):(i + 1) * k + min(i + 1, m)] for i in range(n))
-
-def process_video_batch(video_files, video_ids):
-    session = Session()
-    processed_files = []
-    for video_path, video_id in zip(video_files, video_ids):
+        profiler.end_video(video_id, frame_count)
+
+def iter_video_tracks(video_files, video_ids, batch_size=None, video_fps=None):
+    """
+    Yield (video_path, video_id, tracks) for each video.
+
+    With batch_size > 0 the frames of several videos go through BatchedInferenceEngine;
+    otherwise each video is processed on its own by process_video when it is consumed.
+    video_fps maps video_id to its fps from video_metadata.
+    """
+    batch_size = inference_batch_size if batch_size is None else batch_size
+    if batch_size > 0:
+        engine = BatchedInferenceEngine(get_model(), strided_tracker_path, batch_size=batch_size, hz=analysis_hz)
+        yield from engine.run(zip(video_files, video_ids), video_fps)
+    else:
+        for video_path, video_id in zip(video_files, video_ids):
+            yield video_path, video_id, None
+
+class TrackWriter:
+    """
+    Buffer the tracks of several videos and insert them in one transaction.
+
+    Rows go in as multi-row INSERT ... ON CONFLICT (video_id, track_id) DO NOTHING, so a
+    re-processed video does not fail on its existing tracks. With claimed, the status of the
+    buffered videos is updated in the same transaction and the files of videos in a final
+    status (see FINAL_STATUSES) are deleted; otherwise only video files with tracks are.
+    Files are deleted only after the commit.
+    """
+
+    INSERT_CHUNK = 1000
+    FINAL_STATUSES = (queue.DONE, queue.SKIPPED_STATIC, queue.INVALID)
+
+    def __init__(self, session, claimed=False, batch_videos=None, batch_rows=None):
+        self.session = session
+        self.claimed = claimed
+        self.batch_videos = batch_videos or track_batch_videos
+        self.batch_rows = batch_rows or track_batch_rows
+        self.rows = []
+        self.videos = []
+
+    def add(self, video_path, video_id, tracks, status=queue.DONE, delete_file=None):
+        if delete_file is None:
+            delete_file = status in self.FINAL_STATUSES if self.claimed else bool(tracks)
+        self.rows.extend(tracks)
+        self.videos.append((video_path, video_id, status, delete_file))
+        if len(self.videos) >= self.batch_videos or len(self.rows) >= self.batch_rows:
+            self.flush()
+
+    def flush(self):
+        if not self.videos:
+            return
+        rows, videos = self.rows, self.videos
+        self.rows, self.videos = [], []
+        with profiler.time('db'):
+            inserted = self._write(rows, videos)
+        if inserted is None:
+            return
+        _LOGGER.info(f"Inserted {inserted} tracks for {len(videos)} videos "
+                     f"({len(rows) - inserted} already present)")
+        for video_path, _, _, delete_file in videos:
+            if delete_file:
+                delete_video_file(video_path)
+
+    def _write(self, rows, videos):
+        """Insert the rows and statuses in one transaction; returns the inserted rows, None on error."""
         try:
-            data = process_video(video_path, video_id)
-            if data:
-                for entry in data:
-                    session.add(Track(**entry))
-                session.commit()
-                _LOGGER.info(f"Inserted {len(data)} tracks for video {video_path}")
-                processed_files.append(video_path)
-            else:
-                _LOGGER.info(f"No detections for video {video_path}")
-        except IntegrityError:
-            session.rollback()
-            _LOGGER.warning(f"Duplicate entries for {video_path} skipped.")
+            inserted = 0
+            for i in range(0, len(rows), self.INSERT_CHUNK):
+                statement = insert(Track).values(rows[i:i + self.INSERT_CHUNK]).on_conflict_do_nothing(
+                    index_elements=['video_id', 'track_id'])
+                inserted += self.session.execute(statement).rowcount
+            if self.claimed:
+                statuses = defaultdict(list)
+                for _, video_id, status, _ in videos:
+                    statuses[status].append(video_id)
+                for status, video_ids in statuses.items():
+                    queue.finish_videos(self.session, video_ids, status)
+            self.session.commit()
+            return inserted
         except SQLAlchemyError as e:
-            session.rollback()
-            _LOGGER.error(f"DB error for {video_path}: {e}")
+            self.session.rollback()
+            _LOGGER.error(f"DB error inserting tracks of {len(videos)} videos: {e}")
+            if self.claimed:
+                for _, video_id, _, _ in videos:
+                    release_claim(self.session, video_id, str(e))
+            return None
+
+def process_video_batch(video_files, video_ids, batch_size=None, claimed=False, video_fps=None, writer=None):
+    """
+    Process videos and insert their tracks through a TrackWriter.
+
+    With claimed, the videos were claimed from video_processing and their final status is
+    written in the same transaction as their tracks. video_fps maps video_id to its fps from
+    video_metadata, so the file header is not read again. A writer passed in (see drain_queue)
+    keeps its buffered tracks across calls and is flushed by the caller; otherwise one is
+    created and flushed for these videos.
+    """
+    video_fps = video_fps or {}
+    if writer is not None:
+        _process_videos(video_files, video_ids, batch_size, video_fps, writer)
+        return
+    session = Session()
+    try:
+        writer = TrackWriter(session, claimed=claimed)
+        _process_videos(video_files, video_ids, batch_size, video_fps, writer)
+        writer.flush()
+    finally:
+        session.close()
+
+def _process_videos(video_files, video_ids, batch_size, video_fps, writer):
+    """Add the tracks (or final status) of each video to the writer; claims of failed videos are released."""
+    claimed, session = writer.claimed, writer.session
+    if motion_gate_enabled:
+        video_files, video_ids = skip_static_videos(video_files, video_ids, writer)
+    for video_path, video_id, data in iter_video_tracks(video_files, video_ids, batch_size, video_fps):
+        if claimed and not os.path.exists(video_path):
+            _LOGGER.warning(f"Video file not found: {video_path}")
+            writer.add(video_path, video_id, [], queue.MISSING)
+            continue
+        try:
+            if data is None:
+                data = process_video(video_path, video_id, fps=video_fps.get(video_id))
+            elif isinstance(data, VideoProcessingError):
+                raise data
         except Exception as e:
             _LOGGER.error(f"Error for {video_path}: {e}")
-    for path in processed_files:
-        delete_video_file(path)
-    session.close()
+            if claimed:
+                release_claim(session, video_id, str(e))
+            continue
+        if not data:
+            _LOGGER.info(f"No detections for video {video_path}")
+        writer.add(video_path, video_id, data)
+
+def skip_static_videos(video_files, video_ids, writer):
+    """
+    Drop the videos without motion, recording them as skipped_static.
+
+    Claimed static videos are deleted once their status is committed, like processed ones.
+    """
+    moving_files, moving_ids = [], []
+    for video_path, video_id in zip(video_files, video_ids):
+        if os.path.exists(video_path) and not video_has_motion(video_path, camera_for_video(video_path)):
+            _LOGGER.info(f"No motion in video {video_path}, skipped")
+            motion_stats['videos_skipped'] += 1
+            writer.add(video_path, video_id, [], queue.SKIPPED_STATIC)
+        else:
+            moving_files.append(video_path)
+            moving_ids.append(video_id)
+    return moving_files, moving_ids
+
+def release_claim(session, video_id, error):
+    """Give a claimed video back to the queue after an error."""
+    try:
+        queue.release_video(session, video_id, error)
+        session.commit()
+    except SQLAlchemyError as e:
+        session.rollback()
+        _LOGGER.error(f"Could not update processing state of {video_id}: {e}")
+
+def order_by_size(video_files, video_ids):
+    """Sort videos largest file first so the longest ones do not start at the end of the run."""
+    def size(item):
+        try:
+            return os.path.getsize(item[0])
+        except OSError:
+            return 0
+    return sorted(zip(video_files, video_ids), key=size, reverse=True)
+
+def process_video_task(videos, claimed=False, video_fps=None):
+    """
+    Pool task: process a few (video_path, video_id) pairs.
+
+    Returns (pid, busy seconds, count, worker stats), see take_worker_stats.
+
+    Tasks hold one video, or INFERENCE_BATCH_SIZE videos when the batched engine is enabled.
+    claimed and video_fps are passed on to process_video_batch.
+    """
+    start = time.perf_counter()
+    video_files, video_ids = zip(*videos)
+    process_video_batch(list(video_files), list(video_ids), claimed=claimed, video_fps=video_fps)
+    return os.getpid(), time.perf_counter() - start, len(videos), take_worker_stats()
+
+def log_utilization(worker_stats, elapsed):
+    """Log videos and busy time per worker as a share of the run's wall time."""
+    for pid, (busy, count) in sorted(worker_stats.items()):
+        _LOGGER.info(f"Worker {pid}: {count} videos, busy {busy:.1f}s of {elapsed:.1f}s "
+                     f"({100 * busy / elapsed if elapsed else 0:.0f}% utilization)")
+    if worker_stats:
+        mean = sum(busy for busy, _ in worker_stats.values()) / len(worker_stats)
+        _LOGGER.info(f"Mean worker utilization: {100 * mean / elapsed if elapsed else 0:.0f}%")
+
+def drain_queue(claim_size):
+    """
+    Pool task: claim and process pending videos until the queue is empty.
+
+    Nothing is claimed when this worker has no model, so a load failure does not use up the
+    attempts of every pending video. One TrackWriter buffers the tracks of every claim, so they
+    are committed in batches of TRACK_BATCH_VIDEOS videos whatever the claim size, and what is
+    left is flushed when the queue is empty. Returns (pid, busy seconds, count, worker stats) like
+    process_video_task.
+    """
+    busy, count = 0.0, 0
+    if get_model() is None:
+        _LOGGER.error(f"YOLO model '{model_path}' is not loaded, worker {os.getpid()} claims no videos")
+        return os.getpid(), busy, count, take_worker_stats()
+    session = Session()
+    worker = queue.worker_name()
+    writer = TrackWriter(session, claimed=True)
+    try:
+        while True:
+            rows = queue.claim_videos(session, claim_size, worker)
+            if not rows:
+                break
+            start = time.perf_counter()
+            # RETURNING no conserva el orden de la reclamacion: de la mas larga a la mas corta por duracion,
+            # o por tamano sin metadata
+            if all(row.duration is not None for row in rows):
+                videos = [(os.path.join(videos_galeria_path, row.path), row.video_id)
+                          for row in sorted(rows, key=lambda row: row.duration, reverse=True)]
+            else:
+                videos = order_by_size([os.path.join(videos_galeria_path, row.path) for row in rows],
+                                       [row.video_id for row in rows])
+            video_files, video_ids = zip(*videos)
+            process_video_batch(list(video_files), list(video_ids), claimed=True,
+                                video_fps={row.video_id: row.fps for row in rows if row.fps}, writer=writer)
+            busy += time.perf_counter() - start
+            count += len(rows)
+    except SQLAlchemyError as e:
+        session.rollback()
+        _LOGGER.error(f"DB error while claiming videos: {e}")
+    finally:
+        start = time.perf_counter()
+        writer.flush()
+        busy += time.perf_counter() - start
+        session.close()
+    return os.getpid(), busy, count, take_worker_stats()
+
+def take_worker_stats():
+    """Motion gate counters and profiler aggregates of this worker since the last call."""
+    return {'motion': take_motion_stats(), 'profile': profiler.take_summary()}
+
+class RunStats:
+    """Results of the pool tasks of a run (see drain_queue), logged and reported at the end."""
+
+    def __init__(self):
+        self.worker_stats = defaultdict(lambda: [0.0, 0])
+        self.gate_stats = Counter()
+        self.profiles = defaultdict(list)
+        self.start = time.perf_counter()
+
+    def add(self, result):
+        pid, busy, count, stats = result
+        self.worker_stats[pid][0] += busy
+        self.worker_stats[pid][1] += count
+        self.gate_stats.update(stats['motion'])
+        self.profiles[pid].append(stats['profile'])
+
+    @property
+    def videos(self):
+        return sum(count for _, count in self.worker_stats.values())
+
+    def report(self):
+        elapsed = time.perf_counter() - self.start
+        log_utilization(self.worker_stats, elapsed)
+        if motion_gate_enabled:
+            log_motion_stats(self.gate_stats)
+        write_run_report(self.profiles, {pid: busy for pid, (busy, _) in self.worker_stats.items()}, elapsed)
+
+def log_motion_stats(stats):
+    frames = stats.get('frames_analyzed', 0) + stats.get('frames_skipped', 0)
+    _LOGGER.info(f"Motion gate: {stats.get('frames_skipped', 0)} of {frames} frames and "
+                 f"{stats.get('videos_skipped', 0)} videos skipped")
 
 def main():
-    num_processes = 20
+    num_processes, num_threads = pool_settings(process_workers, threads_per_worker)
+    init_db()
     session = Session()
     try:
-        rows = session.execute(text("SELECT id, path FROM video_recorded")).fetchall()
-        if not rows:
+        # Solo se procesan los videos nuevos o pendientes; otros hosts pueden drenar la misma cola
+        added = queue.enqueue_new_videos(session)
+        recovered = queue.recover_stale_claims(session)
+        delete_invalid_videos(session)
+        pending = queue.count_videos(session, queue.PENDING)
+        _LOGGER.info(f"{added} new videos queued, {recovered} stale claims recovered, {pending} pending.")
+        if not pending:
             _LOGGER.info("No videos found.")
             return
-        video_files = [os.path.join(videos_galeria_path, row.path) for row in rows]
-        video_ids = [row.id for row in rows]
-        parts_files = list(split_list(video_files, num_processes))
-        parts_ids = list(split_list(video_ids, num_processes))
-        with multiprocessing.Pool(processes=num_processes) as pool:
-            pool.starmap(process_video_batch, zip(parts_files, parts_ids))
+        if detector_backend != 'pytorch':
+            # Exportar una sola vez antes de que los procesos carguen el modelo
+            export_model(model_path, detector_backend, detector_precision, detector_imgsz)
+        _LOGGER.info(f"Processing with {num_processes} workers x {num_threads} threads, claiming {claim_size} at a time")
+
+        run_stats = RunStats()
+        with multiprocessing.Pool(processes=num_processes, initializer=init_worker, initargs=(num_threads,)) as pool:
+            for result in pool.imap_unordered(drain_queue, [claim_size] * num_processes):
+                run_stats.add(result)
+        run_stats.report()
         _LOGGER.info("✅ Processing completed.")
     except Exception as e:
         _LOGGER.error(f"❌ Error: {e}")
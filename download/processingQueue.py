@@ -0,0 +1,180 @@
+"""
+Processing state of the recorded videos, kept in the video_processing table.
+
+Every video in video_recorded gets a row with its status (pending, processing, done, missing,
+skipped_static, invalid or failed), the number of attempts and who claimed it. Workers claim small batches of pending
+videos with FOR UPDATE SKIP LOCKED, longest first by the duration in video_metadata, so several
+processes or hosts can drain the same queue without processing a video twice, and claims left
+behind by a crashed worker go back to pending after PROCESS_CLAIM_TIMEOUT_MINUTES. A video given
+back after an error is not claimed again for PROCESS_RETRY_BACKOFF_MINUTES, so its attempts are
+spread over time instead of used up in one run. Videos whose probe found them corrupt or empty
+are set to invalid and never claimed.
+"""
+import os
+import socket
+from sqlalchemy import bindparam, text
+from dotenv import load_dotenv
+
+PENDING = 'pending'
+PROCESSING = 'processing'
+DONE = 'done'
+MISSING = 'missing'
+SKIPPED_STATIC = 'skipped_static'
+INVALID = 'invalid'
+FAILED = 'failed'
+
+# Cargar variables de entorno antes de leer la configuracion
+load_dotenv('.env')
+
+# Intentos antes de marcar un video como fallido y minutos antes de liberar una reclamacion
+max_attempts = int(os.getenv('PROCESS_MAX_ATTEMPTS', '3'))
+claim_timeout_minutes = int(os.getenv('PROCESS_CLAIM_TIMEOUT_MINUTES', '60'))
+# Minutos que espera un video liberado tras un error antes de reclamarse de nuevo
+retry_backoff_minutes = int(os.getenv('PROCESS_RETRY_BACKOFF_MINUTES', '30'))
+
+# Filas de video_processing (alias q) que claim_videos puede reclamar ahora
+CLAIMABLE = """q.status = :pending
+              AND (q.attempts = 0 OR q.updated_at < CURRENT_TIMESTAMP - :backoff * INTERVAL '1 minute')"""
+
+
+def worker_name():
+    """Identify the claiming process across hosts."""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def enqueue_new_videos(session):
+    """
+    Add the videos of video_recorded that have no processing state yet.
+
+    Videos that already have tracks (processed before this table existed) start as done, and
+    videos whose metadata probe failed start as invalid; pending videos probed as invalid since
+    the last run (see videoMetadata.backfill) are set to invalid too.
+    Returns the number of videos added.
+    """
+    result = session.execute(text("""
+        INSERT INTO video_processing (video_id, status)
+        SELECT v.id,
+               CASE WHEN EXISTS (SELECT 1 FROM tracks t WHERE t.video_id = v.id) THEN :done
+                    WHEN EXISTS (SELECT 1 FROM video_metadata m WHERE m.video_id = v.id AND NOT m.valid) THEN :invalid
+                    ELSE :pending END
+        FROM video_recorded v
+        WHERE NOT EXISTS (SELECT 1 FROM video_processing p WHERE p.video_id = v.id)
+        ON CONFLICT (video_id) DO NOTHING
+    """), {"done": DONE, "invalid": INVALID, "pending": PENDING})
+    session.execute(text("""
+        UPDATE video_processing
+        SET status = :invalid, last_error = 'invalid video', updated_at = CURRENT_TIMESTAMP
+        WHERE status = :pending
+          AND EXISTS (SELECT 1 FROM video_metadata m WHERE m.video_id = video_processing.video_id AND NOT m.valid)
+    """), {"invalid": INVALID, "pending": PENDING})
+    session.commit()
+    return result.rowcount
+
+
+def recover_stale_claims(session, timeout_minutes=None):
+    """Return claims older than the timeout to pending, or to failed once out of attempts."""
+    result = session.execute(text("""
+        UPDATE video_processing
+        SET status = CASE WHEN attempts >= :max_attempts THEN :failed ELSE :pending END,
+            claimed_by = NULL,
+            last_error = 'claim expired',
+            updated_at = CURRENT_TIMESTAMP
+        WHERE status = :processing
+          AND claimed_at < CURRENT_TIMESTAMP - :timeout * INTERVAL '1 minute'
+    """), {
+        "max_attempts": max_attempts,
+        "failed": FAILED,
+        "pending": PENDING,
+        "processing": PROCESSING,
+        "timeout": timeout_minutes or claim_timeout_minutes,
+    })
+    session.commit()
+    return result.rowcount
+
+
+def claim_videos(session, limit, worker=None, video_ids=None):
+    """
+    Claim up to `limit` pending videos for this worker.
+
+    The longest videos are claimed first, so they do not start at the end of the run; videos
+    without metadata come after them. Videos released after an error within the last
+    retry_backoff_minutes are left for a later claim. Rows locked by another worker's claim are
+    skipped instead of waited on. With video_ids, only those videos are claimed. The claim is
+    committed before returning. Returns rows with video_id, path, fps and duration (fps and
+    duration are None without metadata).
+    """
+    only_ids = "AND q.video_id = ANY(:video_ids)" if video_ids is not None else ""
+    rows = session.execute(text(f"""
+        WITH claimable AS (
+            SELECT q.video_id
+            FROM video_processing q
+            LEFT JOIN video_metadata m ON m.video_id = q.video_id
+            WHERE {CLAIMABLE}
+              {only_ids}
+            ORDER BY m.duration DESC NULLS LAST, q.updated_at, q.video_id
+            LIMIT :limit
+            FOR UPDATE OF q SKIP LOCKED
+        )
+        UPDATE video_processing p
+        SET status = :processing,
+            attempts = p.attempts + 1,
+            claimed_by = :worker,
+            claimed_at = CURRENT_TIMESTAMP,
+            updated_at = CURRENT_TIMESTAMP
+        FROM claimable c
+        JOIN video_recorded v ON v.id = c.video_id
+        LEFT JOIN video_metadata m ON m.video_id = c.video_id
+        WHERE p.video_id = c.video_id
+        RETURNING p.video_id, v.path, m.fps, m.duration
+    """), {
+        "pending": PENDING,
+        "processing": PROCESSING,
+        "backoff": retry_backoff_minutes,
+        "limit": limit,
+        "worker": worker or worker_name(),
+        "video_ids": list(video_ids or []),
+    }).fetchall()
+    session.commit()
+    return rows
+
+
+def count_claimable(session):
+    """Number of pending videos that claim_videos would claim now (not waiting out a retry backoff)."""
+    return session.execute(text(f"SELECT COUNT(*) FROM video_processing q WHERE {CLAIMABLE}"),
+                           {"pending": PENDING, "backoff": retry_backoff_minutes}).scalar()
+
+
+def invalid_video_paths(session):
+    """Paths of the videos set to invalid (their files are never processed)."""
+    return session.execute(text("""
+        SELECT v.path FROM video_processing p JOIN video_recorded v ON v.id = p.video_id
+        WHERE p.status = :invalid
+    """), {"invalid": INVALID}).scalars().all()
+
+
+def count_videos(session, *statuses):
+    """Number of videos in any of the given statuses."""
+    return session.execute(text(
+        "SELECT COUNT(*) FROM video_processing WHERE status IN :statuses"
+    ).bindparams(bindparam("statuses", expanding=True)), {"statuses": list(statuses)}).scalar()
+
+
+def finish_videos(session, video_ids, status):
+    """Record the final status of claimed videos; committed by the caller."""
+    session.execute(text("""
+        UPDATE video_processing
+        SET status = :status, last_error = NULL, claimed_by = NULL, updated_at = CURRENT_TIMESTAMP
+        WHERE video_id = ANY(:video_ids)
+    """), {"status": status, "video_ids": list(video_ids)})
+
+
+def release_video(session, video_id, error):
+    """Give a claimed video back to the queue after an error, or fail it once out of attempts."""
+    session.execute(text("""
+        UPDATE video_processing
+        SET status = CASE WHEN attempts >= :max_attempts THEN :failed ELSE :pending END,
+            last_error = :error,
+            claimed_by = NULL,
+            updated_at = CURRENT_TIMESTAMP
+        WHERE video_id = :video_id
+    """), {"max_attempts": max_attempts, "failed": FAILED, "pending": PENDING, "error": error, "video_id": video_id})
@@ -0,0 +1,283 @@
+"""
+Opt-in per-stage profiling of the processing pipeline.
+
+Set PROFILE_OUTPUT to enable it. Each worker times the stages of every video (decode, motion,
+inference, tracking, postprocess) and its DB writes (db). At the end of a run the report is
+written to PROFILE_OUTPUT:
+
+- *.prom: a Prometheus textfile (for the node_exporter textfile collector) with frames/s,
+  p50/p95 latency and total time per stage, and busy time and utilization per worker.
+- anything else: JSON lines, one "video" record per processed video (written by the workers
+  as they go), one "worker" record per worker and a "run" record.
+
+Per-worker latencies are kept in log-spaced histograms, so memory does not grow with the
+number of frames.
+"""
+import os
+import time
+import json
+import fcntl
+import bisect
+import numpy as np
+from dotenv import load_dotenv
+
+# Cargar variables de entorno antes de leer la configuracion
+load_dotenv('.env')
+
+profile_output = os.getenv('PROFILE_OUTPUT')
+
+# Limites de los buckets: 1 us a 100 s, 20 por decada (error relativo de ~12% en los percentiles)
+_BUCKET_BOUNDS = [10 ** (exponent / 20) for exponent in range(-120, 41)]
+
+
+class LatencyHistogram:
+    """Log-spaced latency histogram that can be merged across workers."""
+
+    def __init__(self, counts=None, total=0.0):
+        self.counts = list(counts) if counts else [0] * (len(_BUCKET_BOUNDS) + 1)
+        self.total = total
+
+    def add(self, seconds):
+        self.counts[bisect.bisect_left(_BUCKET_BOUNDS, seconds)] += 1
+        self.total += seconds
+
+    def merge(self, other):
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.total += other.total
+
+    @property
+    def count(self):
+        return sum(self.counts)
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-quantile."""
+        target = q * self.count
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if bucket_count and seen >= target:
+                return _BUCKET_BOUNDS[min(index, len(_BUCKET_BOUNDS) - 1)]
+        return 0.0
+
+    def to_dict(self):
+        return {"counts": self.counts, "total": self.total}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["counts"], data["total"])
+
+
+class _Timer:
+    __slots__ = ('profiler', 'stage', 'video_id', 'start')
+
+    def __init__(self, profiler, stage, video_id):
+        self.profiler = profiler
+        self.stage = stage
+        self.video_id = video_id
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.add(self.stage, time.perf_counter() - self.start, self.video_id)
+        return False
+
+
+class _NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class StageProfiler:
+    """Stage timings of one worker process; a no-op unless enabled."""
+
+    def __init__(self, enabled=False, output=None):
+        self.enabled = enabled
+        self.output = output
+        self.histograms = {}
+        self.frames = 0
+        self.videos = 0
+        self._video_samples = {}
+        self._video_start = {}
+
+    def time(self, stage, video_id=None):
+        """Context manager timing one stage, attributed to video_id when given."""
+        if not self.enabled:
+            return _NULL_TIMER
+        return _Timer(self, stage, video_id)
+
+    def add(self, stage, seconds, video_id=None):
+        if not self.enabled:
+            return
+        self.histograms.setdefault(stage, LatencyHistogram()).add(seconds)
+        if video_id in self._video_samples:
+            self._video_samples[video_id].setdefault(stage, []).append(seconds)
+
+    def begin_video(self, video_id):
+        if self.enabled:
+            self._video_samples[video_id] = {}
+            self._video_start[video_id] = time.perf_counter()
+
+    def end_video(self, video_id, frames):
+        """Close a video and append its record when writing JSON lines."""
+        if not self.enabled or video_id not in self._video_samples:
+            return
+        samples = self._video_samples.pop(video_id)
+        seconds = time.perf_counter() - self._video_start.pop(video_id)
+        self.frames += frames
+        self.videos += 1
+        if self.output and not self.output.endswith('.prom'):
+            stages = {}
+            for stage, values in samples.items():
+                values = np.asarray(values)
+                stages[stage] = {
+                    "total": round(float(values.sum()), 6),
+                    "p50": round(float(np.percentile(values, 50)), 6),
+                    "p95": round(float(np.percentile(values, 95)), 6),
+                    "count": int(len(values)),
+                }
+            append_jsonl(self.output, {
+                "type": "video",
+                "video_id": video_id,
+                "pid": os.getpid(),
+                "frames": frames,
+                "seconds": round(seconds, 4),
+                "fps": round(frames / seconds, 2) if seconds else None,
+                "stages": stages,
+            })
+
+    def take_summary(self):
+        """Return the worker's aggregates and reset them."""
+        summary = {
+            "frames": self.frames,
+            "videos": self.videos,
+            "stages": {stage: histogram.to_dict() for stage, histogram in self.histograms.items()},
+        }
+        self.histograms = {}
+        self.frames = 0
+        self.videos = 0
+        return summary
+
+
+profiler = StageProfiler(enabled=bool(profile_output), output=profile_output)
+
+
+def append_jsonl(path, record):
+    """Append a record; the lock keeps lines from several workers whole."""
+    with open(path, 'a') as output_file:
+        fcntl.flock(output_file, fcntl.LOCK_EX)
+        output_file.write(json.dumps(record) + "\n")
+
+
+def merge_summaries(summaries):
+    merged = {"frames": 0, "videos": 0, "stages": {}}
+    for summary in summaries:
+        merged["frames"] += summary["frames"]
+        merged["videos"] += summary["videos"]
+        for stage, data in summary["stages"].items():
+            histogram = LatencyHistogram.from_dict(data)
+            if stage in merged["stages"]:
+                merged["stages"][stage].merge(histogram)
+            else:
+                merged["stages"][stage] = histogram
+    return merged
+
+
+def _stage_report(histograms):
+    return {stage: {"total": round(histogram.total, 4),
+                    "p50": round(histogram.quantile(0.5), 6),
+                    "p95": round(histogram.quantile(0.95), 6),
+                    "count": histogram.count}
+            for stage, histogram in histograms.items()}
+
+
+def write_run_report(worker_summaries, worker_busy, elapsed, output=None):
+    """
+    Write the worker and run records of a run.
+
+    worker_summaries maps pid to the take_summary() results of that worker, worker_busy maps
+    pid to its busy seconds.
+    """
+    output = output or profile_output
+    if not output:
+        return
+    workers = {pid: merge_summaries(summaries) for pid, summaries in worker_summaries.items()}
+    run = merge_summaries(summary for summaries in worker_summaries.values() for summary in summaries)
+    fps = run["frames"] / elapsed if elapsed else 0.0
+
+    if output.endswith('.prom'):
+        write_prometheus(output, run, workers, worker_busy, elapsed, fps)
+        return
+
+    for pid, worker in sorted(workers.items()):
+        busy = worker_busy.get(pid, 0.0)
+        append_jsonl(output, {
+            "type": "worker",
+            "pid": pid,
+            "videos": worker["videos"],
+            "frames": worker["frames"],
+            "busy_seconds": round(busy, 3),
+            "utilization": round(busy / elapsed, 4) if elapsed else None,
+            "stages": _stage_report(worker["stages"]),
+        })
+    append_jsonl(output, {
+        "type": "run",
+        "workers": len(workers),
+        "videos": run["videos"],
+        "frames": run["frames"],
+        "wall_seconds": round(elapsed, 3),
+        "fps": round(fps, 2),
+        "stages": _stage_report(run["stages"]),
+    })
+
+
+def write_prometheus(output, run, workers, worker_busy, elapsed, fps):
+    """Write the run as a Prometheus textfile, replacing the previous one atomically."""
+    lines = [
+        "# HELP galeria_processing_frames_per_second Frames analysed per second of wall time in the last run.",
+        "# TYPE galeria_processing_frames_per_second gauge",
+        f"galeria_processing_frames_per_second {fps:.4f}",
+        "# HELP galeria_processing_videos Videos processed in the last run.",
+        "# TYPE galeria_processing_videos gauge",
+        f"galeria_processing_videos {run['videos']}",
+        "# HELP galeria_processing_wall_seconds Wall time of the last run.",
+        "# TYPE galeria_processing_wall_seconds gauge",
+        f"galeria_processing_wall_seconds {elapsed:.4f}",
+        "# HELP galeria_stage_latency_seconds Stage latency quantiles in the last run.",
+        "# TYPE galeria_stage_latency_seconds gauge",
+    ]
+    for stage, histogram in run["stages"].items():
+        for quantile in (0.5, 0.95):
+            lines.append(f'galeria_stage_latency_seconds{{stage="{stage}",quantile="{quantile}"}} '
+                         f'{histogram.quantile(quantile):.6f}')
+    lines += [
+        "# HELP galeria_stage_seconds Total time per stage in the last run.",
+        "# TYPE galeria_stage_seconds gauge",
+    ]
+    for stage, histogram in run["stages"].items():
+        lines.append(f'galeria_stage_seconds{{stage="{stage}"}} {histogram.total:.4f}')
+    lines += [
+        "# HELP galeria_worker_busy_seconds Busy time per worker in the last run.",
+        "# TYPE galeria_worker_busy_seconds gauge",
+    ]
+    for pid in sorted(workers):
+        lines.append(f'galeria_worker_busy_seconds{{pid="{pid}"}} {worker_busy.get(pid, 0.0):.4f}')
+    lines += [
+        "# HELP galeria_worker_utilization Busy share of the wall time per worker in the last run.",
+        "# TYPE galeria_worker_utilization gauge",
+    ]
+    for pid in sorted(workers):
+        utilization = worker_busy.get(pid, 0.0) / elapsed if elapsed else 0.0
+        lines.append(f'galeria_worker_utilization{{pid="{pid}"}} {utilization:.4f}')
+
+    temp_path = f"{output}.tmp"
+    with open(temp_path, 'w') as output_file:
+        output_file.write("\n".join(lines) + "\n")
+    os.replace(temp_path, output)
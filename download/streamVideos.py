@@ -0,0 +1,117 @@
+import os
+import json
+import shutil
+import logging
+import multiprocessing
+from functools import partial
+from dotenv import load_dotenv
+from download import AzureVideos
+import processingQueue as queue
+from processVideos import (Session, init_db, init_worker, process_video_task, order_by_size, pool_settings,
+                           videos_galeria_path)
+
+_LOGGER = logging.getLogger('video_stream')
+
+# Modo sin disco: los videos se descargan a un buffer en tmpfs, se reclaman en video_processing,
+# se procesan y se borran, sin pasar por videosGaleria/ en el disco local.
+
+
+def move_to_disk(video_path, buffer_dir):
+    """Move a video left in the buffer (failed or not claimed) to videosGaleria for a later run."""
+    target_path = os.path.join(videos_galeria_path, os.path.relpath(video_path, buffer_dir))
+    os.makedirs(os.path.dirname(target_path), exist_ok=True)
+    shutil.move(video_path, target_path)
+    _LOGGER.warning(f"Video not processed, moved to disk for retry: {target_path}")
+
+
+def finish_group(async_result, video_files, buffer_dir):
+    """
+    Wait for a group to be processed and clear what is left of it from the buffer.
+
+    Videos with a final status were deleted by the workers once it was committed; the ones
+    still in the buffer failed and went back to the queue, so processVideos retries them.
+    """
+    async_result.get()
+    for video_path in video_files:
+        if os.path.exists(video_path):
+            move_to_disk(video_path, buffer_dir)
+
+
+def claim_group(session, downloaded):
+    """Queue the recorded videos and claim the downloaded ones; returns the claimed rows."""
+    queue.enqueue_new_videos(session)
+    video_ids = [os.path.basename(path) for path in downloaded]
+    return queue.claim_videos(session, len(video_ids), video_ids=video_ids)
+
+
+def stream_videos(azure_client, paths, group_size=20, num_processes=20, num_threads=None):
+    """
+    Download videos into the tmpfs buffer and feed them to the processing pool.
+
+    The next group is downloaded while the previous one is being processed, so the buffer holds
+    at most two groups. Videos are recorded in video_recorded and claimed in video_processing
+    before processing, so their status is written with their tracks and a video without
+    detections is deleted like one with tracks.
+    """
+    buffer_dir = azure_client.output_dir
+    pending = None
+    session = Session()
+    try:
+        with multiprocessing.Pool(processes=num_processes, initializer=init_worker, initargs=(num_threads,)) as pool:
+            for i in range(0, len(paths), group_size):
+                group = paths[i:i + group_size]
+                # download_videos_by_paths flushes the video_recorded writes before returning;
+                # the downloaded index is only queried for the ids of the group, not the whole table
+                azure_client.download_videos_by_paths(group, index_chunk_size=group_size)
+                # Solo se reclaman los videos en el buffer; los ya registrados siguen en videosGaleria/
+                downloaded = [path for path in group if os.path.exists(os.path.join(buffer_dir, path))]
+                rows = claim_group(session, downloaded)
+                video_files = [os.path.join(buffer_dir, row.path) for row in rows]
+                # Lo no reclamado (invalido, o sin fila en video_recorded) no se procesa: sale de la RAM
+                claimed_ids = {row.video_id for row in rows}
+                for path in downloaded:
+                    if os.path.basename(path) not in claimed_ids:
+                        move_to_disk(os.path.join(buffer_dir, path), buffer_dir)
+
+                if pending:
+                    finish_group(*pending)
+                # Una tarea por proceso, repartiendo los videos del mas grande al mas chico; cada tarea
+                # confirma sus tracks en un solo TrackWriter en lugar de un commit por video
+                videos = order_by_size(video_files, [row.video_id for row in rows])
+                tasks = [videos[k::num_processes] for k in range(min(num_processes, len(videos)))]
+                video_fps = {row.video_id: row.fps for row in rows if row.fps}
+                task = partial(process_video_task, claimed=True, video_fps=video_fps)
+                pending = (pool.map_async(task, tasks), video_files, buffer_dir)
+                _LOGGER.info(f"Group {i // group_size + 1}: {len(video_files)} videos sent to processing.")
+
+            if pending:
+                finish_group(*pending)
+    finally:
+        session.close()
+    _LOGGER.info("✅ Streaming completed.")
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    init_db()
+
+    with open("filtered_paths.json", "r") as json_file:
+        filtered_paths = json.load(json_file)
+
+    # tmpfs-backed buffer, must fit two groups of videos
+    buffer_dir = os.getenv("STREAM_BUFFER_DIR", "/dev/shm/videosGaleria")
+    num_processes, num_threads = pool_settings(os.getenv("STREAM_PROCESSES"), os.getenv("PROCESS_THREADS_PER_WORKER"))
+    # Videos per group (default one per process); larger groups commit several videos per transaction
+    group_size = int(os.getenv("STREAM_GROUP_SIZE") or num_processes)
+
+    azure_client = AzureVideos(
+        output_dir=buffer_dir,
+        sas_token=os.getenv("AZURE_STORAGE_SAS_TOKEN"),
+        account_url=os.getenv("AZURE_STORAGE_ACCOUNT_URL"),
+        max_workers=int(os.getenv("DOWNLOAD_WORKERS", "8"))
+    )
+    try:
+        stream_videos(azure_client, filtered_paths, group_size=group_size, num_processes=num_processes,
+                      num_threads=num_threads)
+    finally:
+        azure_client.close()
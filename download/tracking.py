@@ -0,0 +1,153 @@
+import os
+import numpy as np
+from ultralytics.engine.results import Boxes
+from ultralytics.trackers.basetrack import BaseTrack
+from ultralytics.trackers.track import TRACKER_MAP
+from ultralytics.utils import IterableSimpleNamespace
+from ultralytics.utils.checks import check_yaml
+
+try:
+    from ultralytics.utils import YAML
+    _load_yaml = YAML.load
+except ImportError:  # older ultralytics releases
+    from ultralytics.utils import yaml_load as _load_yaml
+
+# Utilidades compartidas por process_video y el motor de inferencia por lotes
+
+class VideoProcessingError(Exception):
+    """A video could not be analysed (model, file or tracking error), as opposed to having no detections."""
+
+
+class OwnIdTracker:
+    """
+    Tracker with its own track ID counter.
+
+    Older ultralytics releases number tracks with the class-level BaseTrack._count, which every
+    new tracker resets; with several videos tracked in one process (BatchedInferenceEngine) the
+    videos in flight would reuse IDs. The counter of this tracker is swapped in for each update.
+    """
+
+    def __init__(self, tracker):
+        self.tracker = tracker
+        self._count = 0
+
+    def update(self, detections, img=None):
+        shared, BaseTrack._count = BaseTrack._count, self._count
+        try:
+            return self.tracker.update(detections, img)
+        finally:
+            self._count, BaseTrack._count = BaseTrack._count, shared
+
+def create_tracker(tracker_cfg):
+    """Build a standalone tracker (e.g. BoT-SORT) from an ultralytics tracker YAML, with its own track IDs."""
+    cfg = IterableSimpleNamespace(**_load_yaml(check_yaml(tracker_cfg)))
+    return OwnIdTracker(TRACKER_MAP[cfg.tracker_type](args=cfg))
+
+def empty_detections(frame):
+    """Detections of a frame the detector skipped, so the tracker still ages its tracks."""
+    return Boxes(np.empty((0, 6), dtype=np.float32), frame.shape[:2])
+
+def iter_frames(cap, stride=1):
+    """Yield (frame_idx, frame) every `stride` frames; skipped frames are grabbed without decoding."""
+    frame_idx = 0
+    while True:
+        if frame_idx % stride == 0:
+            ok, frame = cap.read()
+            if not ok:
+                return
+            yield frame_idx, frame
+        elif not cap.grab():
+            return
+        frame_idx += 1
+
+
+# Indices de direccion en los contadores por track
+UNKNOWN, FORWARD, BACKWARD = 0, 1, 2
+DIRECTIONS = np.array(['unknown', 'forward', 'backward'])
+
+
+class VideoTrackState:
+    """
+    Per-video track aggregation with constant memory per track.
+
+    Each track keeps its last centroid, last time seen and a count per direction instead of the
+    full (timestamp, direction) history; the boxes of a frame are processed as arrays.
+    """
+
+    def __init__(self, video_path, capacity=64):
+        self.video_name = os.path.basename(video_path).split('.')[0]
+        self.num_tracks = 0
+        # Slot de cada track_id del tracker (-1 = no visto), en orden de aparicion
+        self.slot_of = np.full(capacity, -1, dtype=np.int64)
+        self.track_ids = np.zeros(capacity, dtype=np.int64)
+        self.last_pos = np.zeros((capacity, 2), dtype=np.int64)
+        self.last_time = np.zeros(capacity, dtype=np.float64)
+        self.counts = np.zeros((capacity, 3), dtype=np.int64)
+        # Primera direccion conocida (FORWARD/BACKWARD), desempata como Counter.most_common
+        self.first_dir = np.zeros(capacity, dtype=np.int64)
+
+    def _grow(self, num_slots):
+        capacity = len(self.track_ids)
+        if num_slots <= capacity:
+            return
+        new_capacity = max(num_slots, 2 * capacity)
+        for name in ('track_ids', 'last_pos', 'last_time', 'counts', 'first_dir'):
+            old = getattr(self, name)
+            new = np.zeros((new_capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:capacity] = old
+            setattr(self, name, new)
+
+    def _slots(self, track_ids):
+        """Map tracker ids to slots, assigning new slots in order of first appearance."""
+        if track_ids.max() >= len(self.slot_of):
+            slot_of = np.full(max(track_ids.max() + 1, 2 * len(self.slot_of)), -1, dtype=np.int64)
+            slot_of[:len(self.slot_of)] = self.slot_of
+            self.slot_of = slot_of
+        slots = self.slot_of[track_ids]
+        new = slots < 0
+        if new.any():
+            new_ids = track_ids[new]
+            first = self.num_tracks
+            self._grow(first + len(new_ids))
+            self.slot_of[new_ids] = np.arange(first, first + len(new_ids))
+            self.track_ids[first:first + len(new_ids)] = new_ids
+            self.num_tracks += len(new_ids)
+            slots = self.slot_of[track_ids]
+        return slots, new
+
+    def update(self, timestamp, track_ids, boxes_xyxy):
+        """Record the boxes of one sampled frame."""
+        track_ids = np.asarray(track_ids, dtype=np.int64)
+        if not len(track_ids):
+            return
+        boxes = np.asarray(boxes_xyxy)[:, :4].astype(np.int64)
+        centers = (boxes[:, :2] + boxes[:, 2:]) // 2
+        slots, new = self._slots(track_ids)
+
+        delta = centers - self.last_pos[slots]
+        angles = np.degrees(np.arctan2(delta[:, 1], delta[:, 0]))
+        directions = np.where(new, UNKNOWN, np.where(angles <= 0, FORWARD, BACKWARD))
+
+        np.add.at(self.counts, (slots, directions), 1)
+        first_known = (self.first_dir[slots] == UNKNOWN) & (directions != UNKNOWN)
+        self.first_dir[slots[first_known]] = directions[first_known]
+        self.last_pos[slots] = centers
+        self.last_time[slots] = np.maximum(self.last_time[slots], timestamp)
+
+    def to_rows(self, video_id):
+        """Summarize each track as a row of the tracks table."""
+        n = self.num_tracks
+        counts = self.counts[:n]
+        # Empates: gana la direccion vista primero ('unknown' siempre es la primera)
+        first = self.first_dir[:n]
+        second = np.where(first == BACKWARD, FORWARD, BACKWARD)
+        order = np.stack([np.full(n, UNKNOWN), np.where(first == UNKNOWN, FORWARD, first), second], axis=1)
+        ranked = np.take_along_axis(counts, order, axis=1)
+        common_dir = DIRECTIONS[order[np.arange(n), ranked.argmax(axis=1)]]
+
+        return [{
+            'track_id': f"{track_id}_{self.video_name}",
+            'video_id': video_id,
+            'duration': float(last_time),
+            'direction': str(direction)
+        } for track_id, last_time, direction in zip(self.track_ids[:n].tolist(), self.last_time[:n].tolist(), common_dir)]
@@ -0,0 +1,138 @@
+"""
+Video metadata probe and its index in the video_metadata table.
+
+probe_video reads fps, frame count, duration, resolution, codec and byte size from the file
+header once, when the video is downloaded; processing reads fps from the index and the queue
+uses the duration to hand out the longest videos first and the valid flag to leave corrupt or
+empty files out.
+
+Run this module to probe the videos already in videosGaleria that have no metadata yet:
+    python videoMetadata.py
+"""
+import os
+import cv2
+import psycopg2
+from psycopg2.extras import execute_values
+from dotenv import load_dotenv
+
+METADATA_COLUMNS = ("fps", "frame_count", "duration", "width", "height", "codec", "size_bytes", "valid")
+
+# Same table as in create_tables.sql; the downloader creates it on databases set up before it existed
+METADATA_TABLE_QUERY = """
+CREATE TABLE IF NOT EXISTS video_metadata (
+    video_id VARCHAR(255) NOT NULL,
+    fps DOUBLE PRECISION,
+    frame_count INTEGER,
+    duration DOUBLE PRECISION,
+    width INTEGER,
+    height INTEGER,
+    codec VARCHAR(16),
+    size_bytes BIGINT,
+    valid BOOLEAN NOT NULL,
+    probed_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    CONSTRAINT video_metadata_pkey PRIMARY KEY (video_id),
+    CONSTRAINT video_metadata_video_id_fkey FOREIGN KEY (video_id)
+        REFERENCES video_recorded(id)
+);
+"""
+
+METADATA_INSERT_QUERY = """
+INSERT INTO video_metadata (video_id, fps, frame_count, duration, width, height, codec, size_bytes, valid)
+VALUES %s
+ON CONFLICT (video_id) DO UPDATE SET
+    fps = EXCLUDED.fps,
+    frame_count = EXCLUDED.frame_count,
+    duration = EXCLUDED.duration,
+    width = EXCLUDED.width,
+    height = EXCLUDED.height,
+    codec = EXCLUDED.codec,
+    size_bytes = EXCLUDED.size_bytes,
+    valid = EXCLUDED.valid,
+    probed_at = CURRENT_TIMESTAMP;
+"""
+
+
+def probe_video(video_path):
+    """
+    Read the metadata of a video file without decoding its frames.
+
+    valid is False when the file is missing, empty or cannot be opened; invalid videos are
+    deleted without processing, so a header that only lacks the fps or frame count (duration
+    None) still counts as valid and the video is processed from the file.
+    """
+    metadata = dict.fromkeys(METADATA_COLUMNS)
+    metadata["valid"] = False
+    try:
+        metadata["size_bytes"] = os.path.getsize(video_path)
+    except OSError:
+        return metadata
+    if not metadata["size_bytes"]:
+        return metadata
+
+    cap = cv2.VideoCapture(video_path)
+    try:
+        if not cap.isOpened():
+            return metadata
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        fourcc = int(cap.get(cv2.CAP_PROP_FOURCC))
+        metadata.update({
+            "fps": fps if fps > 0 else None,
+            "frame_count": frame_count if frame_count > 0 else None,
+            "duration": frame_count / fps if fps > 0 and frame_count > 0 else None,
+            "width": int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)) or None,
+            "height": int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)) or None,
+            "codec": "".join(chr((fourcc >> 8 * i) & 0xFF) for i in range(4)).strip("\x00 ") or None,
+        })
+        metadata["valid"] = True
+    finally:
+        cap.release()
+    return metadata
+
+
+def ensure_metadata_table(conn):
+    """Create the video_metadata table if it does not exist yet."""
+    cursor = conn.cursor()
+    cursor.execute(METADATA_TABLE_QUERY)
+    conn.commit()
+    cursor.close()
+
+
+def save_metadata(cursor, rows):
+    """Insert or refresh (video_id, metadata) pairs; committed by the caller."""
+    values = [(video_id, *(metadata[column] for column in METADATA_COLUMNS)) for video_id, metadata in rows]
+    execute_values(cursor, METADATA_INSERT_QUERY, values, page_size=max(1, len(values)))
+
+
+def backfill(conn, videos_dir="videosGaleria"):
+    """Probe the downloaded videos of video_recorded that have no metadata yet."""
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT v.id, v.path FROM video_recorded v
+        WHERE NOT EXISTS (SELECT 1 FROM video_metadata m WHERE m.video_id = v.id);
+    """)
+    rows = [(video_id, probe_video(os.path.join(videos_dir, path)))
+            for video_id, path in cursor.fetchall() if os.path.exists(os.path.join(videos_dir, path))]
+    if rows:
+        save_metadata(cursor, rows)
+    conn.commit()
+    cursor.close()
+    return rows
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    conn = psycopg2.connect(
+        dbname=os.getenv("DB_NAME"),
+        user=os.getenv("DB_USER"),
+        password=os.getenv("DB_PASSWORD"),
+        host=os.getenv("DB_HOST"),
+        port=os.getenv("DB_PORT")
+    )
+    try:
+        ensure_metadata_table(conn)
+        probed = backfill(conn)
+        invalid = sum(1 for _, metadata in probed if not metadata["valid"])
+        print(f"Probed {len(probed)} videos ({invalid} invalid).")
+    finally:
+        conn.close()